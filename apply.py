@@ -1,71 +1,79 @@
 #!/bin/python
-from sys import argv
+from sys import argv, stdin
 import os
 from ncclient import manager
 from ote_utils.utils import Config
-from lxml import etree
+from ote_utils.netconfutils import applyengine
+from ote_utils.netconfutils.configurator import ncclientAgent, t128Configurator
+from ote_utils.netconfutils.netconfconverter import ConfigParseError
 
-class ncclientAgent(object):
-    def __init__(self, ncclient_manager):
-        self.netconf_session = ncclient_manager
-    def editConfig(self, target_config, config_xml):
-        edit_status = self.netconf_session.edit_config(target=target_config, config=config_xml)
-        return edit_status
-    def replaceConfig(self, target_config, config_xml):
-        replace_status = self.netconf_session.edit_config(target=target_config, config=config_xml, default_operation="replace")
-        return replace_status
-    def removeConfig(self, target_config, config_xml):
-        remove_status = self.netconf_session.delete_config(source=config_xml, target=target_config)
-        return remove_status
-    def commitConfig(self, validationType='distributed'):
-        if validationType == 'distributed':
-          commit_status = self.netconf_session.commit()
-        else:
-          commit_command = etree.Element('{urn:ietf:params:xml:ns:netconf:base:1.0}commit', {'nc':'urn:ietf:params:xml:ns:netconf:base:1.0'})
-          vt = etree.Element('{urn:128technology:netconf:validate-type:1.0}validation-type', {'vt':'urn:128technology:netconf:validate-type:1.0'})
-          vt.text = validationType
-          commit_command.append(vt)
-          commit_status = self.netconf_session.dispatch(commit_command)
-        self.netconf_session.close_session()
-        return commit_status
+MODEL_CACHE_DIR = os.path.expanduser('~/.cache/ote_utils')
 
-class t128Configurator(object):
-    def __init__(self, config_agent):
-        self.config_agent = config_agent
-    def config(self, candidate_config_xml, state):
-        action_status = "None"
-        if state == "edit":
-            action_status = self.config_agent.editConfig("candidate", candidate_config_xml)
-        if state == "replace":
-            action_status = self.config_agent.replaceConfig("candidate", candidate_config_xml)
-        return action_status
-    def commit(self, validationType='distributed'):
-        commit_status = self.config_agent.commitConfig(validationType=validationType)
-        return commit_status
+def _print_chunk(chunk_status):
+    print "Chunk {0} {1}: {2} bytes in {3:.2f}s{4}".format(chunk_status.index, chunk_status.label, chunk_status.size, chunk_status.seconds, '' if chunk_status.ok else ', rejected')
 
-def _commit_config_xml(config_xml, t128_host='127.0.0.1', t128_port='830', t128_user='admin', t128_publickey='/home/admin/.ssh/pdc_ssh_key',  validationType='distributed'):
+def _commit_config_xml(config_xml, t128_host='127.0.0.1', t128_port='830', t128_user='admin', t128_publickey='/home/admin/.ssh/pdc_ssh_key',  validationType='distributed', diff_converter=None, chunked=False):
     netconf_session = manager.connect(host=t128_host, port=t128_port, username=t128_user, key_filename=t128_publickey,
                                           allow_agent=True, look_for_keys=False, hostkey_verify=False)
     ncclient_agent = ncclientAgent(netconf_session)
-    t128_configurator = t128Configurator(ncclient_agent)
-    config_status = t128_configurator.config(config_xml, 'edit')
+    try:
+        if diff_converter is not None:
+            running_xml = netconf_session.get_config(source='running').data
+            try:
+                config_xml = diff_converter.diff_netconf_xml(running_xml, config_xml, partial=True)
+            except ConfigParseError as e:
+                print "Cannot compare with the running configuration: {0}".format(e)
+                return
+            if config_xml is None:
+                print "The running configuration already matches, nothing to apply"
+                return
+        t128_configurator = t128Configurator(ncclient_agent)
+        if chunked:
+            config_status = t128_configurator.config(config_xml, 'chunked', progress=_print_chunk)
+        else:
+            config_status = t128_configurator.config(config_xml, 'edit')
 
-    if config_status.ok:
-        commit_status = t128_configurator.commit(validationType=validationType)
-        if commit_status.ok:
-            print "Configuration committed successfully"
+        if config_status.ok:
+            commit_status = t128_configurator.commit(validationType=validationType)
+            if commit_status.ok:
+                print "Configuration committed successfully"
+            else:
+                print "There was an error committing the config"
         else:
-            print "There was an error committing the config"
-    else:
-        print "There was an error adding the candidate config"
+            print "There was an error adding the candidate config"
+    finally:
+        ncclient_agent.close()
 
-if len(argv) < 2:
+args = [arg for arg in argv[1:] if arg != '--diff']
+diff = len(args) < len(argv) - 1
+chunked = '--chunked' in args
+if chunked:
+  args.remove('--chunked')
+inventory = None
+if '--inventory' in args[:-1]:
+  inventory = args.pop(args.index('--inventory') + 1)
+  args.remove('--inventory')
+if len(args) < 1:
   print "This tool will apply a 128T configuration to the local router/conductor over the NETCONF interface. The configuration must be saved to a file in flat-text format"
-  print "Usage: {0} filename".format(argv[0])
+  print "Usage: {0} [--chunked] [--diff | --inventory hostsfile] filename".format(argv[0])
+  print "Use - as the filename to read the configuration from stdin"
+  print "With --diff only the differences from the running configuration are sent. The file may hold part of the configuration: each router, service, tenant or other list entry in it replaces the running one, and anything missing outside of those entries is kept. Use delete lines to remove whole entries"
+  print "With --chunked the configuration is sent as one edit per group of routers, services, tenants and other top-level objects, then committed once"
+  print "With --inventory the configuration is applied to every host listed in hostsfile, one 'host [port [user [keyfile]]]' per line"
+elif inventory is not None and diff:
+  print "--diff cannot be combined with --inventory"
 else:
-  with open(argv[1], 'r') as config:
-    config_text = config.read()
   cc = Config.Config()
-  cc.load_t128_config_model('/var/model/consolidatedT128Model.xml')
-  config_text_xml = cc.convert_config_to_netconf_xml(config_text.split('\n'))
-  _commit_config_xml(config_text_xml, validationType='local')
+  cc.load_t128_config_model('/var/model/consolidatedT128Model.xml', cache_dir=MODEL_CACHE_DIR)
+  if args[0] == '-':
+    config_text_xml = cc.convert_config_to_netconf_xml(stdin, pretty=False)
+  else:
+    with open(args[0], 'r') as config:
+      config_text_xml = cc.convert_config_to_netconf_xml(config, pretty=False)
+  if inventory is not None:
+    hosts = applyengine.load_inventory(inventory, key_filename='/home/admin/.ssh/pdc_ssh_key')
+    fleet_applier = applyengine.FleetApplier(validationType='local', max_failure_rate=0.1, state='chunked' if chunked else 'edit')
+    print applyengine.format_results(fleet_applier.apply(config_text_xml, hosts))
+    fleet_applier.close()
+  else:
+    _commit_config_xml(config_text_xml, validationType='local', diff_converter=cc.ncconv if diff else None, chunked=chunked)
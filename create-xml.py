@@ -1,19 +1,35 @@
 #!/bin/python
-from sys import argv
+from sys import argv, stdin
 import os
+import tempfile
 from ncclient import manager
 from ote_utils.utils import Config
 from lxml import etree
 
+MODEL_CACHE_DIR = os.path.expanduser('~/.cache/ote_utils')
+
 if len(argv) < 3:
   print "This tool will create an XML 128T configuration from a text config, for example the output of 'show config runnning'."
   print "Usage: {0} <text config filename> <xml config filename>".format(argv[0])
+  print "Use - as the text config filename to read the configuration from stdin"
 else:
-  with open(argv[1], 'r') as config:
-    config_text = config.read()
   cc = Config.Config()
-  cc.load_t128_config_model('/var/model/consolidatedT128Model.xml')
-  config_xml = cc.convert_config_to_netconf_xml(config_text.split('\n'))
-  config_text_xml = etree.tostring(config_xml)
-  with open(argv[2], 'w') as xml_file:
-    xml_file.write(config_text_xml)
+  cc.load_t128_config_model('/var/model/consolidatedT128Model.xml', cache_dir=MODEL_CACHE_DIR)
+  # Write next to the target and rename on success, so a config that fails
+  # to convert never leaves a truncated xml file behind.
+  xml_dir = os.path.dirname(os.path.abspath(argv[2]))
+  xml_file = tempfile.NamedTemporaryFile(dir=xml_dir, prefix='.create-xml-', delete=False)
+  try:
+    with xml_file:
+      if argv[1] == '-':
+        cc.convert_config_to_netconf_xml(stdin, output=xml_file)
+      else:
+        with open(argv[1], 'r') as config:
+          cc.convert_config_to_netconf_xml(config, output=xml_file)
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(xml_file.name, 0o666 & ~umask)
+    os.rename(xml_file.name, argv[2])
+  except:
+    os.remove(xml_file.name)
+    raise
@@ -0,0 +1,215 @@
+"""
+Applies one converted config to many routers concurrently. The config is
+serialized once and the same payload is sent to every host from a bounded
+set of worker threads, each using the ncclientAgent and t128Configurator
+helpers over a pooled session.
+"""
+
+import collections
+import threading
+import time
+
+from past.builtins import basestring
+from lxml import etree
+from queue import Queue, Empty
+
+from ote_utils.netconfutils.configurator import ncclientAgent, t128Configurator
+from ote_utils.netconfutils.sessionpool import NetconfSessionPool
+from ote_utils.ote_logger import OteLogger
+
+logger = OteLogger(__name__)
+
+COMMITTED = "committed"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+Host = collections.namedtuple("Host", ["host", "port", "username", "key_filename"])
+HostResult = collections.namedtuple("HostResult", ["host", "status", "seconds", "error"])
+
+
+class ApplyError(Exception):
+
+    "Exception class for a host that rejected the config or the commit"
+
+
+def load_inventory(path, port=830, username="admin", key_filename=None):
+    """
+    Reads a host inventory file with one host per line as
+    'host [port [username [key_filename]]]'. Blank lines and lines starting
+    with # are ignored; missing fields take the given defaults.
+    """
+    hosts = []
+    with open(path) as inventory:
+        for line in inventory:
+            fields = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            defaults = [None, port, username, key_filename]
+            fields = fields + defaults[len(fields):]
+            hosts.append(Host(fields[0], int(fields[1]), fields[2], fields[3]))
+    return hosts
+
+
+class FleetApplier(object):
+
+    """
+    Pushes a config to a list of hosts with at most max_workers in flight.
+    Each host gets timeout seconds for connecting and for every rpc. When
+    more than max_failure_rate of all hosts have failed no further hosts are
+    started; those are reported as skipped.
+    """
+
+    def __init__(
+        self,
+        max_workers=8,
+        timeout=60,
+        max_failure_rate=None,
+        validationType="distributed",
+        state="edit",
+        pool=None,
+    ):
+        """
+        Args:
+            max_workers (int): number of hosts configured at once
+            timeout (float): seconds allowed for connecting and for each rpc
+            max_failure_rate (float): fraction of hosts, 0 to 1, that may fail
+                before the rollout stops (default: never stop)
+            validationType (str): commit validation type
+            state (str): edit, replace or chunked
+            pool (NetconfSessionPool): sessions to use (default: a pool
+                sized for max_workers)
+        """
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_failure_rate = max_failure_rate
+        self.validationType = validationType
+        self.state = state
+        if pool is None:
+            pool = NetconfSessionPool(max_size=max_workers, timeout=timeout)
+        self.pool = pool
+
+    def apply(self, config_xml, hosts):
+        """
+        Applies the config to every host and returns a list of HostResult in
+        inventory order
+
+        Args:
+            config_xml (element or str): converted config
+            hosts (list): Host tuples or host names
+        """
+        if not isinstance(config_xml, basestring):
+            config_xml = etree.tostring(config_xml, encoding="unicode")
+        hosts = [self._get_host(host) for host in hosts]
+
+        pending = Queue()
+        for index, host in enumerate(hosts):
+            pending.put((index, host))
+        results = [None] * len(hosts)
+        state = {"failed": 0, "stopped": False}
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                try:
+                    index, host = pending.get_nowait()
+                except Empty:
+                    return
+                with lock:
+                    stopped = state["stopped"]
+                if stopped:
+                    results[index] = HostResult(host.host, SKIPPED, 0.0, None)
+                    continue
+                result = self._apply_host(config_xml, host)
+                results[index] = result
+                logger.info("{}: {} in {:.2f}s".format(host.host, result.status, result.seconds))
+                with lock:
+                    if result.status == FAILED:
+                        state["failed"] += 1
+                        if self._should_stop(state["failed"], len(hosts)):
+                            state["stopped"] = True
+
+        workers = [
+            threading.Thread(target=worker, name="fleet-apply-{}".format(number))
+            for number in range(min(self.max_workers, len(hosts)))
+        ]
+        for thread in workers:
+            thread.daemon = True
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return results
+
+    def close(self):
+        """
+        Closes the pooled sessions
+        """
+        self.pool.close_all()
+
+    def _should_stop(self, failed, total):
+        if self.max_failure_rate is None:
+            return False
+        return float(failed) / total > self.max_failure_rate
+
+    def _get_host(self, host):
+        if isinstance(host, Host):
+            return host
+        return Host(host, 830, "admin", None)
+
+    def _apply_host(self, config_xml, host):
+        start = time.time()
+        try:
+            # Failures raise inside the block so the session is discarded
+            # instead of reused. The candidate datastore is shared by all
+            # sessions to the host, so the part of the change it may hold is
+            # discarded first, or the next commit there would include it.
+            with self.pool.session(*host, timeout=self.timeout) as netconf_session:
+                if hasattr(netconf_session, "timeout"):
+                    netconf_session.timeout = self.timeout
+                try:
+                    self._edit_and_commit(netconf_session, config_xml)
+                except Exception:
+                    _discard_changes(netconf_session, host.host)
+                    raise
+        except ApplyError as e:
+            return HostResult(host.host, FAILED, time.time() - start, str(e))
+        except Exception as e:
+            error = "{}: {}".format(type(e).__name__, e)
+            return HostResult(host.host, FAILED, time.time() - start, error)
+        return HostResult(host.host, COMMITTED, time.time() - start, None)
+
+    def _edit_and_commit(self, netconf_session, config_xml):
+        t128_configurator = t128Configurator(ncclientAgent(netconf_session))
+        config_status = t128_configurator.config(config_xml, self.state)
+        if not config_status.ok:
+            raise ApplyError("There was an error adding the candidate config")
+        commit_status = t128_configurator.commit(validationType=self.validationType)
+        if not commit_status.ok:
+            raise ApplyError("There was an error committing the config")
+
+
+def _discard_changes(netconf_session, host):
+    try:
+        netconf_session.discard_changes()
+    except Exception as e:
+        logger.warning("{}: Could not discard the candidate changes: {}".format(host, e))
+
+
+def format_results(results):
+    """
+    Returns the results as a text table followed by a summary line
+    """
+    width = max([len("HOST")] + [len(result.host) for result in results])
+    lines = ["{:<{width}}  {:<9}  {:>8}  {}".format("HOST", "STATUS", "SECONDS", "ERROR", width=width)]
+    for result in results:
+        lines.append(
+            "{:<{width}}  {:<9}  {:>8.2f}  {}".format(
+                result.host, result.status, result.seconds, result.error or "", width=width
+            ).rstrip()
+        )
+    counts = collections.Counter(result.status for result in results)
+    lines.append(
+        "{} committed, {} failed, {} skipped".format(
+            counts[COMMITTED], counts[FAILED], counts[SKIPPED]
+        )
+    )
+    return "\n".join(lines)
@@ -0,0 +1,374 @@
+"""
+Asyncio NETCONF client and async counterparts of the configurator helpers,
+so one event loop can drive many router sessions without a thread per
+in-flight rpc. Requires Python 3.7 or newer.
+
+Sessions speak NETCONF framing directly over asyncio streams: over SSH with
+the optional asyncssh package, or over plain TCP with connect_tcp, which is
+meant for local test servers.
+"""
+
+import asyncio
+import itertools
+
+from lxml import etree
+
+from ote_utils.netconfutils.configurator import NETCONF_NS, get_commit_command
+from ote_utils.ote_logger import OteLogger
+
+logger = OteLogger(__name__)
+
+BASE_1_0 = "urn:ietf:params:netconf:base:1.0"
+BASE_1_1 = "urn:ietf:params:netconf:base:1.1"
+END_OF_MESSAGE = b"]]>]]>"
+DEFAULT_TIMEOUT = 30
+
+
+class NetconfError(Exception):
+
+    "Exception class for NETCONF sessions that failed or closed"
+
+
+class AsyncRPCReply(object):
+
+    """
+    Parsed rpc-reply. Like ncclient's RPCReply, ok is False if the reply
+    holds an rpc-error of severity error.
+    """
+
+    def __init__(self, xml):
+        self.xml = xml
+        self._root = etree.fromstring(xml)
+        self.errors = self._root.findall("{%s}rpc-error" % NETCONF_NS)
+
+    @property
+    def ok(self):
+        for error in self.errors:
+            if error.findtext("{%s}error-severity" % NETCONF_NS) != "warning":
+                return False
+        return True
+
+    @property
+    def data(self):
+        return self._root.find("{%s}data" % NETCONF_NS)
+
+    @property
+    def message_id(self):
+        return self._root.get("message-id")
+
+
+class AsyncNetconfSession(object):
+
+    """
+    NETCONF session over an asyncio stream pair. Replies are matched to
+    requests by message-id, so several rpcs may be outstanding at once.
+    """
+
+    def __init__(self, reader, writer, closer=None, timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self.session_id = None
+        self.server_capabilities = []
+        self._reader = reader
+        self._writer = writer
+        self._closer = closer
+        self._chunked = False
+        self._message_ids = itertools.count(1)
+        self._pending = {}
+        self._reader_task = None
+        self._error = None
+
+    @property
+    def connected(self):
+        return self._reader_task is not None and self._error is None
+
+    async def open(self):
+        """
+        Exchanges hello messages and starts reading replies
+        """
+        hello = etree.Element("{%s}hello" % NETCONF_NS, nsmap={"nc": NETCONF_NS})
+        capabilities = etree.SubElement(hello, "{%s}capabilities" % NETCONF_NS)
+        for capability in (BASE_1_0, BASE_1_1):
+            etree.SubElement(capabilities, "{%s}capability" % NETCONF_NS).text = capability
+        self._writer.write(etree.tostring(hello) + END_OF_MESSAGE)
+
+        server_hello = etree.fromstring(
+            (await asyncio.wait_for(self._reader.readuntil(END_OF_MESSAGE), self.timeout))[
+                : -len(END_OF_MESSAGE)
+            ]
+        )
+        self.server_capabilities = [
+            capability.text.strip()
+            for capability in server_hello.iter("{%s}capability" % NETCONF_NS)
+        ]
+        self.session_id = server_hello.findtext("{%s}session-id" % NETCONF_NS)
+        self._chunked = BASE_1_1 in self.server_capabilities
+        self._reader_task = asyncio.ensure_future(self._read_replies())
+        return self
+
+    async def rpc(self, operation, timeout=None):
+        """
+        Sends an rpc wrapping the operation element and returns its reply
+
+        Args:
+            operation (element): rpc operation, e.g. an edit-config element
+            timeout (float): seconds to wait for the reply (default: the
+                session timeout)
+        """
+        future = self.send_rpc(operation)
+        await self._writer.drain()
+        try:
+            return await asyncio.wait_for(future, self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            raise NetconfError("Timed out waiting for the rpc-reply")
+
+    def send_rpc(self, operation):
+        """
+        Sends an rpc without waiting and returns a future for its reply
+        """
+        if not self.connected:
+            raise NetconfError("NETCONF session is not connected: {}".format(self._error))
+        message_id = str(next(self._message_ids))
+        rpc = etree.Element(
+            "{%s}rpc" % NETCONF_NS, {"message-id": message_id}, nsmap={"nc": NETCONF_NS}
+        )
+        rpc.append(operation)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[message_id] = future
+        self._write_message(etree.tostring(rpc))
+        return future
+
+    async def edit_config(self, target, config, default_operation=None):
+        operation = _element("edit-config")
+        _element("target", operation).append(_element(target))
+        if default_operation is not None:
+            _element("default-operation", operation).text = default_operation
+        if not isinstance(config, etree._Element):
+            config = etree.fromstring(config)
+        operation.append(config)
+        return await self.rpc(operation)
+
+    async def delete_config(self, source, target):
+        operation = _element("delete-config")
+        _element("target", operation).append(_element(target))
+        return await self.rpc(operation)
+
+    async def get_config(self, source="running", filter=None):
+        operation = _element("get-config")
+        _element("source", operation).append(_element(source))
+        if filter is not None:
+            operation.append(filter)
+        return await self.rpc(operation)
+
+    async def commit(self):
+        return await self.rpc(_element("commit"))
+
+    async def discard_changes(self):
+        return await self.rpc(_element("discard-changes"))
+
+    async def dispatch(self, rpc_command):
+        if not isinstance(rpc_command, etree._Element):
+            rpc_command = etree.fromstring(rpc_command)
+        return await self.rpc(rpc_command)
+
+    async def close_session(self):
+        """
+        Ends the NETCONF session and closes the connection
+        """
+        try:
+            if self.connected:
+                await self.rpc(_element("close-session"))
+        finally:
+            self._shutdown(NetconfError("NETCONF session closed"))
+            self._writer.close()
+            if self._closer is not None:
+                self._closer()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close_session()
+
+    def _write_message(self, message):
+        if self._chunked:
+            self._writer.write(b"\n#%d\n" % len(message) + message + b"\n##\n")
+        else:
+            self._writer.write(message + END_OF_MESSAGE)
+
+    async def _read_message(self):
+        if not self._chunked:
+            return (await self._reader.readuntil(END_OF_MESSAGE))[: -len(END_OF_MESSAGE)]
+        chunks = []
+        while True:
+            header = await self._reader.readuntil(b"\n#")
+            size = (await self._reader.readuntil(b"\n"))[:-1]
+            if size == b"#":
+                return b"".join(chunks)
+            if header != b"\n#" or not size.isdigit():
+                raise NetconfError("Invalid chunk framing")
+            chunks.append(await self._reader.readexactly(int(size)))
+
+    async def _read_replies(self):
+        try:
+            while True:
+                reply = AsyncRPCReply(await self._read_message())
+                future = self._pending.pop(reply.message_id, None)
+                if future is None:
+                    logger.debug("Ignoring rpc-reply with unknown message-id {}".format(
+                        reply.message_id
+                    ))
+                elif not future.done():
+                    future.set_result(reply)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self._shutdown(NetconfError("NETCONF session lost: {}".format(e)))
+
+    def _shutdown(self, error):
+        if self._error is None:
+            self._error = error
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(self._error)
+        self._pending.clear()
+        if self._reader_task is not None and self._reader_task is not asyncio.current_task():
+            self._reader_task.cancel()
+
+
+async def connect_tcp(host, port, timeout=DEFAULT_TIMEOUT):
+    """
+    Opens a NETCONF session over plain TCP, e.g. to a local test server
+    """
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    return await AsyncNetconfSession(reader, writer, timeout=timeout).open()
+
+
+async def connect(host, port=830, username="admin", key_filename=None, timeout=DEFAULT_TIMEOUT):
+    """
+    Opens a NETCONF session over SSH. Requires the asyncssh package.
+    """
+    try:
+        import asyncssh
+    except ImportError:
+        raise NetconfError("The asyncssh package is required for NETCONF over SSH")
+
+    connection = await asyncio.wait_for(
+        asyncssh.connect(
+            host,
+            int(port),
+            username=username,
+            client_keys=[key_filename] if key_filename else None,
+            known_hosts=None,
+        ),
+        timeout,
+    )
+    writer, reader, _ = await connection.open_session(subsystem="netconf", encoding=None)
+    return await AsyncNetconfSession(reader, writer, connection.close, timeout).open()
+
+
+class AsyncNcclientAgent(object):
+
+    "Async counterpart of configurator.ncclientAgent"
+
+    def __init__(self, netconf_session):
+        self.netconf_session = netconf_session
+
+    async def editConfig(self, target_config, config_xml):
+        return await self.netconf_session.edit_config(target=target_config, config=config_xml)
+
+    async def replaceConfig(self, target_config, config_xml):
+        return await self.netconf_session.edit_config(
+            target=target_config, config=config_xml, default_operation="replace"
+        )
+
+    async def removeConfig(self, target_config, config_xml):
+        return await self.netconf_session.delete_config(source=config_xml, target=target_config)
+
+    async def commitConfig(self, validationType="distributed"):
+        if validationType == "distributed":
+            return await self.netconf_session.commit()
+        return await self.netconf_session.dispatch(get_commit_command(validationType))
+
+    async def close(self):
+        await self.netconf_session.close_session()
+
+
+class AsyncT128Configurator(object):
+
+    "Async counterpart of configurator.t128Configurator"
+
+    def __init__(self, config_agent):
+        self.config_agent = config_agent
+
+    async def config(self, candidate_config_xml, state):
+        action_status = "None"
+        if state == "edit":
+            action_status = await self.config_agent.editConfig("candidate", candidate_config_xml)
+        if state == "replace":
+            action_status = await self.config_agent.replaceConfig("candidate", candidate_config_xml)
+        return action_status
+
+    async def commit(self, validationType="distributed"):
+        return await self.config_agent.commitConfig(validationType=validationType)
+
+
+async def async_commit_config_xml(
+    config_xml,
+    t128_host="127.0.0.1",
+    t128_port="830",
+    t128_user="admin",
+    t128_publickey="/home/admin/.ssh/pdc_ssh_key",
+    validationType="distributed",
+    diff_converter=None,
+    connect=connect,
+):
+    """
+    Async counterpart of apply.py's _commit_config_xml. Returns True if the
+    config was committed or nothing needed to change.
+
+    Args:
+        config_xml (element or str): converted config
+        diff_converter (NetconfConverter): send only the differences from
+            the running config; like apply.py --diff, config_xml may be
+            partial and only list entries in it are replaced
+        connect (coroutine function): opens the session, given host, port,
+            username and key_filename
+    """
+    netconf_session = await connect(t128_host, t128_port, t128_user, t128_publickey)
+    async with netconf_session:
+        if diff_converter is not None:
+            running_xml = (await netconf_session.get_config(source="running")).data
+            config_xml = diff_converter.diff_netconf_xml(running_xml, config_xml, partial=True)
+            if config_xml is None:
+                logger.info("{}: The running configuration already matches".format(t128_host))
+                return True
+        t128_configurator = AsyncT128Configurator(AsyncNcclientAgent(netconf_session))
+        config_status = await t128_configurator.config(config_xml, "edit")
+        if not config_status.ok:
+            logger.error("{}: There was an error adding the candidate config".format(t128_host))
+            await _discard_changes(netconf_session, t128_host)
+            return False
+        commit_status = await t128_configurator.commit(validationType=validationType)
+        if not commit_status.ok:
+            logger.error("{}: There was an error committing the config".format(t128_host))
+            await _discard_changes(netconf_session, t128_host)
+            return False
+    return True
+
+
+async def _discard_changes(netconf_session, host):
+    # The candidate is shared by all sessions to the host, so a partial
+    # change left in it would go out with the next commit there.
+    try:
+        reply = await netconf_session.discard_changes()
+    except NetconfError as e:
+        logger.warning("{}: Could not discard the candidate changes: {}".format(host, e))
+        return
+    if not reply.ok:
+        logger.warning("{}: Could not discard the candidate changes".format(host))
+
+
+def _element(tag, parent=None):
+    if parent is None:
+        return etree.Element("{%s}%s" % (NETCONF_NS, tag), nsmap={"nc": NETCONF_NS})
+    return etree.SubElement(parent, "{%s}%s" % (NETCONF_NS, tag))
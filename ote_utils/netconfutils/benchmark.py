@@ -0,0 +1,256 @@
+"""
+Conversion throughput benchmark for NetconfConverter.
+
+Generates synthetic configs of increasing size and nesting depth, converts
+each one in a fresh process and reports lines per second, peak resident
+memory and model load time. Results are written as JSON so runs from
+different releases can be compared:
+
+    python -m ote_utils.netconfutils.benchmark --model MODEL --output bench.json
+    python -m ote_utils.netconfutils.benchmark --model MODEL --baseline bench.json
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+
+from ote_utils.netconfutils import netconfconverter
+
+
+MAX_DEPTH = 5
+DEFAULT_ROUTER_COUNTS = (1, 10, 100, 1000)
+DEFAULT_DEPTHS = (1, 3, MAX_DEPTH)
+RESULTS_VERSION = 2
+
+
+def generate_config(routers, interfaces, depth=MAX_DEPTH):
+    """
+    Returns a synthetic flat-text config as a list of lines with the given
+    number of routers, each with one node holding the given number of device
+    interfaces with one network interface and address apiece.
+
+    depth is the number of nested list levels under the authority: routers
+    (1), node (2), device interfaces (3), network interfaces (4) and
+    addresses (5). Shallower configs stop at that level.
+
+    Args:
+        routers (int): number of routers under the authority
+        interfaces (int): number of device interfaces per router
+        depth (int): nested list levels, from 1 to MAX_DEPTH
+    """
+    if not 1 <= depth <= MAX_DEPTH:
+        raise ValueError("depth must be between 1 and {}".format(MAX_DEPTH))
+    lines = ["config", "    authority", "        name Authority128"]
+    for router in range(routers):
+        router_name = "router{}".format(router)
+        lines.extend([
+            "        router {}".format(router_name),
+            "            name {}".format(router_name),
+            "            location site{}".format(router),
+        ])
+        if depth > 1:
+            lines.extend([
+                "            node node1",
+                "                name node1",
+                "                role combo",
+            ])
+            for interface in range(interfaces if depth > 2 else 0):
+                lines.extend([
+                    "                device-interface {}".format(interface),
+                    "                    name {}".format(interface),
+                    "                    type ethernet",
+                    "                    pci-address 0000:00:{:02x}.0".format(interface % 256),
+                ])
+                if depth > 3:
+                    lines.extend([
+                        "                    network-interface intf{}".format(interface),
+                        "                        name intf{}".format(interface),
+                        "                        global-id {}".format(interface + 1),
+                        "                        vlan 0",
+                    ])
+                    if depth > 4:
+                        address = "10.{}.{}.1".format(router % 256, interface % 256)
+                        lines.extend([
+                            "                        address {}".format(address),
+                            "                            ip-address {}".format(address),
+                            "                            prefix-length 24",
+                            "                            gateway 10.{}.{}.254".format(
+                                router % 256, interface % 256
+                            ),
+                            "                        exit",
+                        ])
+                    lines.append("                    exit")
+                lines.append("                exit")
+            lines.append("            exit")
+        lines.append("        exit")
+    lines.extend(["    exit", "exit"])
+    return lines
+
+
+def run_case(case):
+    """
+    Loads the model and converts one synthetic config, returning a result
+    dict. Meant to run in its own process so peak RSS covers only this case.
+
+    Args:
+        case (tuple): (model file, routers, interfaces, pretty, depth)
+    """
+    model_file, routers, interfaces, pretty, depth = case
+    config = generate_config(routers, interfaces, depth)
+
+    converter = netconfconverter.NetconfConverter()
+    start = time.time()
+    converter.load_config_model(model_file)
+    load_seconds = time.time() - start
+
+    start = time.time()
+    converter.convert_config_to_netconf_xml(config, "config", pretty=pretty)
+    convert_seconds = time.time() - start
+
+    return {
+        "routers": routers,
+        "interfaces": interfaces,
+        "depth": depth,
+        "pretty": pretty,
+        "lines": len(config),
+        "model_load_seconds": load_seconds,
+        "convert_seconds": convert_seconds,
+        "lines_per_second": len(config) / convert_seconds if convert_seconds else None,
+        "peak_rss_kb": _get_peak_rss_kb(),
+    }
+
+
+def run_benchmark(
+    model_file,
+    router_counts=DEFAULT_ROUTER_COUNTS,
+    interfaces=4,
+    pretty=True,
+    depths=DEFAULT_DEPTHS,
+):
+    """
+    Runs every case, one per depth and router count, in a fresh worker
+    process and returns the results document
+
+    Args:
+        model_file (str): Consolidated model Config xml file
+        router_counts (list): router count of each synthetic config
+        interfaces (int): number of device interfaces per router
+        pretty (bool): convert with indentation text nodes
+        depths (list): nested list levels of the synthetic configs
+    """
+    results = []
+    for depth in depths:
+        for routers in router_counts:
+            case = (model_file, routers, interfaces, pretty, depth)
+            pool = multiprocessing.Pool(1, maxtasksperchild=1)
+            try:
+                results.append(pool.apply(run_case, (case,)))
+            finally:
+                pool.close()
+                pool.join()
+
+    return {
+        "version": RESULTS_VERSION,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "model_file": model_file,
+        "results": results,
+    }
+
+
+def compare_results(baseline, current):
+    """
+    Returns report lines comparing the lines per second of matching cases
+
+    Args:
+        baseline (dict): earlier results document
+        current (dict): new results document
+    """
+    def case_key(result):
+        return (
+            result["routers"],
+            result["interfaces"],
+            result.get("depth", MAX_DEPTH),
+            result.get("pretty", True),
+        )
+
+    baseline_results = dict((case_key(result), result) for result in baseline["results"])
+    report = []
+    for result in current["results"]:
+        previous = baseline_results.get(case_key(result))
+        if previous is None or not previous["lines_per_second"]:
+            continue
+        ratio = result["lines_per_second"] / previous["lines_per_second"]
+        report.append(
+            "{:>5} routers depth {}: {:>10.0f} lines/s vs {:>10.0f} baseline ({:+.1%})".format(
+                result["routers"],
+                result.get("depth", MAX_DEPTH),
+                result["lines_per_second"],
+                previous["lines_per_second"],
+                ratio - 1,
+            )
+        )
+    return report
+
+
+def _get_peak_rss_kb():
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak_rss //= 1024
+    return peak_rss
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="NetconfConverter throughput benchmark")
+    parser.add_argument(
+        "--model",
+        required=True,
+        help="consolidated model file, e.g. /var/model/consolidatedT128Model.xml",
+    )
+    parser.add_argument(
+        "--routers",
+        default=",".join(str(count) for count in DEFAULT_ROUTER_COUNTS),
+        help="comma separated router counts",
+    )
+    parser.add_argument("--interfaces", type=int, default=4, help="interfaces per router")
+    parser.add_argument(
+        "--depths",
+        default=",".join(str(depth) for depth in DEFAULT_DEPTHS),
+        help="comma separated nested list levels, from 1 to {}".format(MAX_DEPTH),
+    )
+    parser.add_argument("--compact", action="store_true", help="convert with pretty=False")
+    parser.add_argument("--output", help="file to write the JSON results to")
+    parser.add_argument("--baseline", help="earlier JSON results to compare against")
+    args = parser.parse_args(argv)
+
+    document = run_benchmark(
+        args.model,
+        [int(count) for count in args.routers.split(",")],
+        args.interfaces,
+        not args.compact,
+        [int(depth) for depth in args.depths.split(",")],
+    )
+
+    for result in document["results"]:
+        print(
+            "{routers:>5} routers depth {depth} {lines:>9} lines: "
+            "{lines_per_second:>10.0f} lines/s, "
+            "load {model_load_seconds:.3f}s, peak rss {peak_rss_kb} kB".format(**result)
+        )
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            for line in compare_results(json.load(baseline_file), document):
+                print(line)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(document, output_file, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+"""
+Helper classes wrapping an ncclient session to edit and commit 128T
+configuration, as used by apply.py.
+"""
+
+import copy
+import time
+
+from past.builtins import basestring
+from lxml import etree
+
+from ote_utils.ote_logger import OteLogger
+
+logger = OteLogger(__name__)
+
+NETCONF_NS = "urn:ietf:params:xml:ns:netconf:base:1.0"
+VALIDATE_TYPE_NS = "urn:128technology:netconf:validate-type:1.0"
+DEFAULT_CHUNK_BYTES = 512 * 1024
+OPERATION_ATTRIBUTE = "{%s}operation" % NETCONF_NS
+
+
+class ncclientAgent(object):
+
+    """
+    Wraps an ncclient session. The session stays open after a commit so it
+    can be reused for further changes; call close when done with it, or
+    hand it back to the NetconfSessionPool it came from.
+    """
+
+    def __init__(self, ncclient_manager):
+        self.netconf_session = ncclient_manager
+
+    def editConfig(self, target_config, config_xml):
+        edit_status = self.netconf_session.edit_config(target=target_config, config=config_xml)
+        return edit_status
+
+    def replaceConfig(self, target_config, config_xml):
+        replace_status = self.netconf_session.edit_config(
+            target=target_config, config=config_xml, default_operation="replace"
+        )
+        return replace_status
+
+    def removeConfig(self, target_config, config_xml):
+        remove_status = self.netconf_session.delete_config(source=config_xml, target=target_config)
+        return remove_status
+
+    def editConfigChunked(
+        self, target_config, config_xml, max_chunk_bytes=DEFAULT_CHUNK_BYTES, progress=None
+    ):
+        """
+        Sends the config as several edit-config rpcs, split along the
+        top-level list entries by split_config, and returns a
+        ChunkedEditStatus. Stops at the first chunk that is not ok and
+        discards the changes already made to the candidate.
+
+        Args:
+            target_config (str): datastore to edit
+            config_xml (element or str): converted config
+            max_chunk_bytes (int): approximate size limit of each chunk
+            progress (callable): called with the ChunkStatus of every chunk
+                sent (default: log it)
+        """
+        edit_status = ChunkedEditStatus()
+        for label, chunk in split_config(config_xml, max_chunk_bytes):
+            size = len(etree.tostring(chunk))
+            start = time.time()
+            reply = self.netconf_session.edit_config(target=target_config, config=chunk)
+            chunk_status = ChunkStatus(len(edit_status.chunks) + 1, label, size, time.time() - start, reply)
+            edit_status.chunks.append(chunk_status)
+            (progress or _log_chunk)(chunk_status)
+            if not chunk_status.ok:
+                if target_config == "candidate":
+                    self.netconf_session.discard_changes()
+                break
+        return edit_status
+
+    def commitConfig(self, validationType="distributed"):
+        if validationType == "distributed":
+            commit_status = self.netconf_session.commit()
+        else:
+            commit_status = self.netconf_session.dispatch(get_commit_command(validationType))
+        return commit_status
+
+    def close(self):
+        self.netconf_session.close_session()
+
+    def transaction(self):
+        """
+        Returns a NetconfTransaction queueing rpcs to pipeline over this
+        agent's session
+        """
+        return NetconfTransaction(self)
+
+
+class t128Configurator(object):
+
+    def __init__(self, config_agent):
+        self.config_agent = config_agent
+
+    def config(self, candidate_config_xml, state, max_chunk_bytes=DEFAULT_CHUNK_BYTES, progress=None):
+        action_status = "None"
+        if state == "edit":
+            action_status = self.config_agent.editConfig("candidate", candidate_config_xml)
+        if state == "replace":
+            action_status = self.config_agent.replaceConfig("candidate", candidate_config_xml)
+        if state == "chunked":
+            action_status = self.config_agent.editConfigChunked(
+                "candidate", candidate_config_xml, max_chunk_bytes, progress
+            )
+        return action_status
+
+    def commit(self, validationType="distributed"):
+        commit_status = self.config_agent.commitConfig(validationType=validationType)
+        return commit_status
+
+
+class RPCResult(object):
+
+    """
+    Outcome of one rpc of a NetconfTransaction. reply is None if the rpc
+    was not answered, with the reason in error.
+    """
+
+    def __init__(self, operation, message_id, reply=None, error=None):
+        self.operation = operation
+        self.message_id = message_id
+        self.reply = reply
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None and self.reply is not None and self.reply.ok
+
+    def __repr__(self):
+        return "RPCResult({!r}, {!r}, ok={})".format(self.operation, self.message_id, self.ok)
+
+
+class NetconfTransaction(object):
+
+    """
+    Queues rpcs and sends them back to back over one session without
+    waiting for each reply, using ncclient's async mode, which matches
+    replies to requests by message-id. A commit waits for the replies of
+    everything queued before it and is only sent if all of them were ok, so
+    a failed edit is never committed.
+
+        transaction = ncclient_agent.transaction()
+        transaction.editConfig("candidate", authority_xml)
+        transaction.editConfig("candidate", router_xml)
+        transaction.validateConfig()
+        transaction.commitConfig(validationType="local")
+        results = transaction.execute()
+    """
+
+    def __init__(self, config_agent):
+        self.config_agent = config_agent
+        self._operations = []
+
+    def editConfig(self, target_config, config_xml):
+        self._queue("edit-config", self.config_agent.editConfig, target_config, config_xml)
+
+    def replaceConfig(self, target_config, config_xml):
+        self._queue("edit-config", self.config_agent.replaceConfig, target_config, config_xml)
+
+    def validateConfig(self, source="candidate"):
+        self._queue("validate", self.config_agent.netconf_session.validate, source=source)
+
+    def commitConfig(self, validationType="distributed"):
+        self._queue("commit", self.config_agent.commitConfig, validationType=validationType)
+
+    def execute(self, timeout=None):
+        """
+        Sends the queued rpcs and returns an RPCResult for each in queue
+        order. The queue is emptied.
+
+        Args:
+            timeout (float): seconds to wait for all replies (default: no
+                limit)
+        """
+        operations, self._operations = self._operations, []
+        deadline = None if timeout is None else time.time() + timeout
+        session = self.config_agent.netconf_session
+        async_mode = session.async_mode
+        session.async_mode = True
+        results = []
+        in_flight = []
+        try:
+            for operation, send, args, kwargs in operations:
+                if operation == "commit":
+                    results.extend(self._wait(in_flight, deadline))
+                    in_flight = []
+                    if not all(result.ok for result in results):
+                        results.append(RPCResult(operation, None, error="Not sent: an earlier rpc failed"))
+                        continue
+                in_flight.append((operation, send(*args, **kwargs)))
+            results.extend(self._wait(in_flight, deadline))
+        finally:
+            session.async_mode = async_mode
+        return results
+
+    def _queue(self, operation, send, *args, **kwargs):
+        self._operations.append((operation, send, args, kwargs))
+
+    def _wait(self, in_flight, deadline):
+        results = []
+        for operation, rpc in in_flight:
+            remaining = None if deadline is None else max(deadline - time.time(), 0)
+            if not rpc.event.wait(remaining):
+                results.append(RPCResult(operation, rpc.id, error="Timed out waiting for the rpc-reply"))
+            elif rpc.error is not None:
+                results.append(RPCResult(operation, rpc.id, error=str(rpc.error)))
+            else:
+                results.append(RPCResult(operation, rpc.id, rpc.reply))
+        return results
+
+
+class ChunkStatus(object):
+
+    "Outcome of one edit-config sent by ncclientAgent.editConfigChunked"
+
+    def __init__(self, index, label, size, seconds, reply):
+        self.index = index
+        self.label = label
+        self.size = size
+        self.seconds = seconds
+        self.reply = reply
+
+    @property
+    def ok(self):
+        return self.reply.ok
+
+
+class ChunkedEditStatus(object):
+
+    """
+    Outcome of ncclientAgent.editConfigChunked. ok is True if every chunk
+    was accepted.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    @property
+    def ok(self):
+        return bool(self.chunks) and all(chunk.ok for chunk in self.chunks)
+
+    @property
+    def size(self):
+        return sum(chunk.size for chunk in self.chunks)
+
+    @property
+    def seconds(self):
+        return sum(chunk.seconds for chunk in self.chunks)
+
+
+def split_config(config_xml, max_chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Splits a converted config into smaller configs which together make the
+    same change when merged into a datastore, yielding (label, config
+    element) tuples.
+
+    The tree is descended through its single-child wrappers (config,
+    t128 config, authority) and each wrapper's name key is repeated in every
+    chunk. A wrapper created by the change keeps its create operation only
+    in the first chunk, and wrappers with any other operation are not
+    descended into. The other leaves at the level reached go into the first
+    chunk and its entries, such as routers, services and tenants, are
+    grouped into chunks of about max_chunk_bytes each. An entry is never
+    split, so a single entry larger than max_chunk_bytes makes a chunk of
+    its own. Chunks are only valid for merging; a chunked replace would
+    remove everything not in the last chunk.
+
+    Args:
+        config_xml (element or str): converted config
+        max_chunk_bytes (int): approximate size limit of each chunk, or None
+            for one entry per chunk
+    """
+    if isinstance(config_xml, basestring):
+        config_xml = etree.fromstring(config_xml)
+
+    wrappers = [config_xml]
+    while True:
+        children = [child for child in wrappers[-1] if isinstance(child.tag, basestring)]
+        if len(children) != 1 or not _is_entry(children[0]):
+            break
+        if children[0].get(OPERATION_ATTRIBUTE) not in (None, "create"):
+            break
+        wrappers.append(children[0])
+
+    def new_chunk(leaves=(), first=False):
+        root = parent = None
+        for wrapper in wrappers:
+            elem = etree.Element(wrapper.tag, wrapper.attrib, nsmap=wrapper.nsmap)
+            if not first:
+                # Later chunks merge into what the first chunk created.
+                elem.attrib.pop(OPERATION_ATTRIBUTE, None)
+            key = _get_entry_key(wrapper)
+            if key is not None:
+                elem.append(_copy_element(key))
+            if parent is None:
+                root = elem
+            else:
+                parent.append(elem)
+            parent = elem
+        for leaf in leaves:
+            parent.append(_copy_element(leaf))
+        return root, parent
+
+    wrapper_label = etree.QName(wrappers[-1]).localname
+    key = _get_entry_key(wrappers[-1])
+    leaves = [child for child in children if not _is_entry(child) and child is not key]
+    chunk, parent = new_chunk(leaves, first=True)
+    labels = [wrapper_label] if leaves else []
+    size = 0
+    for entry in (child for child in children if _is_entry(child)):
+        entry_size = len(etree.tostring(entry))
+        if labels and (max_chunk_bytes is None or size + entry_size > max_chunk_bytes):
+            yield _get_chunk_label(labels), chunk
+            chunk, parent = new_chunk()
+            labels, size = [], 0
+        parent.append(_copy_element(entry))
+        labels.append(_get_entry_label(entry))
+        size += entry_size
+    yield _get_chunk_label(labels or [wrapper_label]), chunk
+
+
+def _is_entry(elem):
+    return any(isinstance(child.tag, basestring) for child in elem)
+
+
+def _copy_element(elem):
+    elem_copy = copy.deepcopy(elem)
+    elem_copy.tail = None
+    return elem_copy
+
+
+def _get_entry_key(entry):
+    return entry.find("{%s}name" % etree.QName(entry).namespace)
+
+
+def _get_entry_label(entry):
+    name = entry.findtext("{%s}name" % etree.QName(entry).namespace)
+    label = etree.QName(entry).localname
+    return label if name is None else "{} {}".format(label, name)
+
+
+def _get_chunk_label(labels):
+    if len(labels) == 1:
+        return labels[0]
+    return "{} (+{} more)".format(labels[0], len(labels) - 1)
+
+
+def _log_chunk(chunk_status):
+    logger.info(
+        "Chunk {} {}: {} bytes in {:.2f}s ({:.0f} kB/s){}".format(
+            chunk_status.index,
+            chunk_status.label,
+            chunk_status.size,
+            chunk_status.seconds,
+            chunk_status.size / 1024.0 / chunk_status.seconds if chunk_status.seconds else 0,
+            "" if chunk_status.ok else ", rejected",
+        )
+    )
+
+
+def get_commit_command(validationType):
+    """
+    Returns the commit rpc element requesting the given validation type
+    """
+    commit_command = etree.Element("{%s}commit" % NETCONF_NS, {"nc": NETCONF_NS})
+    vt = etree.Element("{%s}validation-type" % VALIDATE_TYPE_NS, {"vt": VALIDATE_TYPE_NS})
+    vt.text = validationType
+    commit_command.append(vt)
+    return commit_command
@@ -0,0 +1,433 @@
+"""
+Validation of config leaf values against the YANG types of a consolidated
+model, so invalid values are reported during conversion instead of by the
+router.
+"""
+
+import decimal
+import re
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+from past.builtins import basestring
+from lxml import etree
+
+from ote_utils.ote_logger import OteLogger
+
+logger = OteLogger(__name__)
+
+YIN_NAMESPACE = "urn:ietf:params:xml:ns:yang:yin:1"
+TYPE_TAG = str(etree.QName(YIN_NAMESPACE, "type"))
+INTEGER_BOUNDS = {
+    "int8": (-2 ** 7, 2 ** 7 - 1),
+    "int16": (-2 ** 15, 2 ** 15 - 1),
+    "int32": (-2 ** 31, 2 ** 31 - 1),
+    "int64": (-2 ** 63, 2 ** 63 - 1),
+    "uint8": (0, 2 ** 8 - 1),
+    "uint16": (0, 2 ** 16 - 1),
+    "uint32": (0, 2 ** 32 - 1),
+    "uint64": (0, 2 ** 64 - 1),
+}
+# XSD character class escapes used by the ietf-inet-types patterns which the
+# re module does not understand.
+XSD_CLASS_ESCAPES = ((r"\p{N}", r"\d"), (r"\p{L}", r"\w"))
+
+
+class LeafValueError(ValueError):
+
+    "Exception class for leaf values not allowed by their YANG type"
+
+
+class LeafValidator(object):
+
+    """
+    Assigned to NetconfConverter.validator to validate leaf values during
+    conversion against the leaf types compiled with the model. With
+    check_leafrefs set, leafref values must also match a value of the
+    referenced leaf elsewhere in the same config.
+    """
+
+    def __init__(self, check_leafrefs=False):
+        self.check_leafrefs = check_leafrefs
+        self._values = None
+        self._references = None
+
+    def begin(self):
+        """
+        Starts collecting leaf values and leafref references for a conversion
+        """
+        self._values = {}
+        self._references = []
+
+    def record_value(self, node_id, value):
+        if self._values is not None:
+            self._values.setdefault(node_id, set()).add(value)
+
+    def add_reference(self, target_id, value, name, location=None):
+        if self._references is not None:
+            self._references.append((target_id, value, name, location))
+
+    def finish(self):
+        """
+        Stops collecting and returns a (LeafValueError, location) tuple for
+        every leafref whose value was not found in the referenced leaf, in
+        the order they were added; location is as given to add_reference
+        """
+        values, references = self._values, self._references
+        self._values = self._references = None
+        unresolved = []
+        for target_id, value, name, location in references or ():
+            if value not in values.get(target_id, ()):
+                error = LeafValueError(
+                    "Leaf {}: Invalid value {}: no such value in the referenced "
+                    "leaf".format(name, value)
+                )
+                unresolved.append((error, location))
+        return unresolved
+
+
+def compile_type(type_elem, cache=None):
+    """
+    Returns the validator for a yin type element
+
+    Args:
+        type_elem (element): yin type element of a leaf
+        cache (dict): optional dict of validators by type definition, so
+            leaves sharing a type share one validator
+    """
+    if cache is None:
+        return _compile_type(type_elem)
+    signature = etree.tostring(type_elem)
+    validator = cache.get(signature)
+    if validator is None:
+        validator = _compile_type(type_elem)
+        cache[signature] = validator
+    return validator
+
+
+class _TypeValidator(object):
+
+    """
+    Validator for a single YANG type. validate raises LeafValueError for a
+    value outside the type; leafref_path is the referenced path of a leafref.
+    """
+
+    leafref_path = None
+
+    def __init__(self, name):
+        self.name = name
+
+    def validate(self, value):
+        raise NotImplementedError
+
+    def _fail(self, value, reason):
+        raise LeafValueError(
+            "Invalid value {} for type {}: {}".format(value, self.name, reason)
+        )
+
+
+class _AnyValidator(_TypeValidator):
+
+    def validate(self, value):
+        pass
+
+
+class _StringValidator(_TypeValidator):
+
+    _compiled_patterns = None
+
+    def __init__(self, name, lengths, patterns):
+        super(_StringValidator, self).__init__(name)
+        self.lengths = lengths
+        self.patterns = patterns
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_compiled_patterns", None)
+        return state
+
+    def validate(self, value):
+        if self.lengths and not _in_ranges(len(value), self.lengths):
+            self._fail(value, "length must be " + _format_ranges(self.lengths))
+        if self._compiled_patterns is None:
+            # Compiled on first use rather than with the model, which keeps
+            # model loading fast since most types are never validated.
+            self._compiled_patterns = _compile_expressions(self.patterns)
+        for expression, regex, invert, message in self._compiled_patterns:
+            if (regex.match(value) is not None) == invert:
+                self._fail(value, message or "must match " + expression)
+
+
+class _IntegerValidator(_TypeValidator):
+
+    def __init__(self, name, ranges):
+        super(_IntegerValidator, self).__init__(name)
+        self.ranges = ranges
+
+    def validate(self, value):
+        try:
+            number = int(value)
+        except ValueError:
+            self._fail(value, "must be an integer")
+        if not _in_ranges(number, self.ranges):
+            self._fail(value, "must be in range " + _format_ranges(self.ranges))
+
+
+class _DecimalValidator(_TypeValidator):
+
+    def __init__(self, name, ranges, fraction_digits):
+        super(_DecimalValidator, self).__init__(name)
+        self.ranges = ranges
+        self.fraction_digits = fraction_digits
+
+    def validate(self, value):
+        try:
+            number = decimal.Decimal(value)
+        except decimal.InvalidOperation:
+            self._fail(value, "must be a decimal number")
+        if not number.is_finite():
+            self._fail(value, "must be a decimal number")
+        if -number.as_tuple().exponent > self.fraction_digits:
+            self._fail(value, "must have at most {} fraction digits".format(
+                self.fraction_digits
+            ))
+        if self.ranges and not _in_ranges(number, self.ranges):
+            self._fail(value, "must be in range " + _format_ranges(self.ranges))
+
+
+class _EnumerationValidator(_TypeValidator):
+
+    def __init__(self, name, values):
+        super(_EnumerationValidator, self).__init__(name)
+        self.values = frozenset(values)
+
+    def validate(self, value):
+        if value not in self.values:
+            self._fail(value, "must be one of " + ", ".join(sorted(self.values)))
+
+
+class _BitsValidator(_EnumerationValidator):
+
+    def validate(self, value):
+        for bit in value.split():
+            if bit not in self.values:
+                self._fail(value, "bits must be from " + ", ".join(sorted(self.values)))
+
+
+class _EmptyValidator(_TypeValidator):
+
+    def validate(self, value):
+        self._fail(value, "leaf does not take a value")
+
+
+class _UnionValidator(_TypeValidator):
+
+    def __init__(self, name, members):
+        super(_UnionValidator, self).__init__(name)
+        self.members = members
+
+    def validate(self, value):
+        for member in self.members:
+            try:
+                member.validate(value)
+                return
+            except LeafValueError:
+                pass
+        self._fail(value, "does not match any member type")
+
+
+class _LeafrefValidator(_TypeValidator):
+
+    def __init__(self, name, path, target):
+        super(_LeafrefValidator, self).__init__(name)
+        self.leafref_path = path
+        self.target = target
+
+    def validate(self, value):
+        self.target.validate(value)
+
+
+def _compile_type(type_elem, name=None, ranges=None, lengths=None, patterns=()):
+    """
+    Builds the validator for a yin type element. Named types carry their
+    typedef inline in the consolidated model; restrictions on the outer
+    type are applied on top of the ones from the typedef.
+    """
+    name = name or type_elem.get("name")
+    children = _get_children_by_keyword(type_elem)
+    if ranges is None:
+        ranges = _first(children, "range")
+    if lengths is None:
+        lengths = _first(children, "length")
+    patterns = tuple(patterns) + tuple(
+        pattern
+        for pattern in (_compile_pattern(elem) for elem in children.get("pattern", ()))
+        if pattern is not None
+    )
+
+    typedef = children.get("typedef")
+    if typedef:
+        base_type = typedef[0].find(TYPE_TAG)
+        if base_type is not None:
+            return _compile_type(base_type, name, ranges, lengths, patterns)
+        return _AnyValidator(name)
+
+    base_name = type_elem.get("name")
+    if base_name == "string":
+        return _StringValidator(
+            name, _parse_ranges(lengths, (0, None), int), patterns
+        )
+    if base_name in INTEGER_BOUNDS:
+        bounds = INTEGER_BOUNDS[base_name]
+        return _IntegerValidator(name, _parse_ranges(ranges, bounds, int) or [bounds])
+    if base_name == "decimal64":
+        fraction_digits = int(_first(children, "fraction-digits", "18"))
+        return _DecimalValidator(
+            name, _parse_ranges(ranges, (None, None), decimal.Decimal), fraction_digits
+        )
+    if base_name == "boolean":
+        return _EnumerationValidator(name, ("true", "false"))
+    if base_name == "enumeration":
+        return _EnumerationValidator(
+            name, [enum.get("name") for enum in children.get("enum", ())]
+        )
+    if base_name == "bits":
+        return _BitsValidator(name, [bit.get("name") for bit in children.get("bit", ())])
+    if base_name == "empty":
+        return _EmptyValidator(name)
+    if base_name == "union":
+        return _UnionValidator(
+            name, [_compile_type(member) for member in children.get("type", ())]
+        )
+    if base_name == "leafref":
+        target_types = children.get("type")
+        target = _compile_type(target_types[0]) if target_types else _AnyValidator(name)
+        return _LeafrefValidator(name, _first(children, "path"), target)
+    return _AnyValidator(name)
+
+
+def _get_children_by_keyword(elem):
+    children = {}
+    for child in elem:
+        if not isinstance(child.tag, basestring) or etree.QName(child).namespace != YIN_NAMESPACE:
+            continue
+        children.setdefault(etree.QName(child).localname, []).append(child)
+    return children
+
+
+def _first(children, keyword, default=None):
+    if keyword not in children:
+        return default
+    return children[keyword][0].get("value", children[keyword][0].get("name"))
+
+
+def _compile_pattern(pattern_elem):
+    expression = pattern_elem.get("value")
+    for xsd_escape, escape in XSD_CLASS_ESCAPES:
+        expression = expression.replace(xsd_escape, escape)
+
+    if _may_backtrack_exponentially(expression):
+        # The re module backtracks, so patterns like the dynamic-hostname
+        # '(([a-z]){0,61}\.?)*' take exponential time on values that do not
+        # match. They are left for the router to check.
+        logger.debug("Not validating locally against pattern {}".format(expression))
+        return None
+
+    invert = False
+    message = None
+    for child in pattern_elem:
+        keyword = etree.QName(child).localname
+        if keyword == "modifier":
+            invert = child.get("value") == "invert-match"
+        elif keyword == "error-message":
+            message = child.findtext("{%s}value" % YIN_NAMESPACE)
+    return expression, invert, message
+
+
+def _may_backtrack_exponentially(expression):
+    """
+    Returns True if the expression repeats without bound a group that can
+    match the empty string or is itself just a repetition, such as (a?)*
+    or (a+)+, which the re module matches in exponential time
+    """
+    try:
+        return _has_ambiguous_repeat(sre_parse.parse(expression))
+    except (re.error, ValueError, TypeError):
+        return False
+
+
+def _has_ambiguous_repeat(subpattern):
+    for op, av in subpattern:
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            _, high, item = av
+            if high == sre_parse.MAXREPEAT and (
+                item.getwidth()[0] == 0 or _is_repeat(item)
+            ):
+                return True
+            if _has_ambiguous_repeat(item):
+                return True
+        elif op == sre_parse.SUBPATTERN:
+            if _has_ambiguous_repeat(av[-1]):
+                return True
+        elif op == sre_parse.BRANCH:
+            if any(_has_ambiguous_repeat(branch) for branch in av[1]):
+                return True
+    return False
+
+
+def _is_repeat(item):
+    while len(item) == 1 and item[0][0] == sre_parse.SUBPATTERN:
+        item = item[0][1][-1]
+    return (
+        len(item) == 1
+        and item[0][0] in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT)
+        and item[0][1][0] != item[0][1][1]
+    )
+
+
+def _compile_expressions(patterns):
+    compiled = []
+    for expression, invert, message in patterns:
+        try:
+            regex = re.compile("(?:" + expression + r")\Z")
+        except re.error:
+            logger.debug("Not validating locally against pattern {}".format(expression))
+            continue
+        compiled.append((expression, regex, invert, message))
+    return compiled
+
+
+def _parse_ranges(expression, bounds, convert):
+    """
+    Parses a YANG range or length expression such as '1..10 | 20 | 30..max'
+    into a list of (low, high) tuples, where None is unbounded
+    """
+    if expression is None:
+        return []
+    ranges = []
+    for part in expression.split("|"):
+        limits = [limit.strip() for limit in part.split("..")]
+        low = bounds[0] if limits[0] == "min" else convert(limits[0])
+        high = limits[-1]
+        high = bounds[1] if high == "max" else convert(high)
+        ranges.append((low, high))
+    return ranges
+
+
+def _in_ranges(number, ranges):
+    for low, high in ranges:
+        if (low is None or number >= low) and (high is None or number <= high):
+            return True
+    return False
+
+
+def _format_ranges(ranges):
+    return " | ".join(
+        str(low) if low == high else "{}..{}".format(
+            "min" if low is None else low, "max" if high is None else high
+        )
+        for low, high in ranges
+    )
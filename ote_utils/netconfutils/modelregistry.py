@@ -0,0 +1,93 @@
+"""
+Registry of loaded config models for converting configs of several versions.
+"""
+
+import collections
+import os
+import threading
+
+from ote_utils.netconfutils import netconfconverter
+
+
+class ModelRegistry(object):
+
+    """
+    Loads config models by version or path on demand and keeps the most
+    recently used ones in memory, evicting the least recently used model once
+    more than max_models are loaded.
+    """
+
+    def __init__(self, max_models=4, cache_dir=None):
+        """
+        Args:
+            max_models (int): number of loaded models to keep in memory
+            cache_dir (str): optional model cache directory passed to
+                NetconfConverter.load_config_model
+        """
+        if max_models < 1:
+            raise ValueError("max_models must be at least 1")
+        self.max_models = max_models
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._model_files = {}
+        self._converters = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, version, model_file):
+        """
+        Associates a version name with a consolidated model file
+
+        Args:
+            version (str): version name, for example '4.1.0'
+            model_file (str): Consolidated model Config xml file
+        """
+        with self._lock:
+            self._model_files[version] = model_file
+
+    def get_converter(self, version_or_path):
+        """
+        Returns a NetconfConverter with the requested model loaded, loading it
+        if it is not already held by the registry
+
+        Args:
+            version_or_path (str): a registered version or a model file path
+        """
+        model_file = os.path.abspath(
+            self._model_files.get(version_or_path, version_or_path)
+        )
+        with self._lock:
+            converter = self._converters.pop(model_file, None)
+            if converter is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                converter = netconfconverter.NetconfConverter()
+                converter.load_config_model(model_file, self.cache_dir)
+            self._converters[model_file] = converter
+
+            while len(self._converters) > self.max_models:
+                self._converters.popitem(last=False)
+                self.evictions += 1
+        return converter
+
+    def clear(self):
+        """
+        Drops all loaded models, keeping registered versions and counters
+        """
+        with self._lock:
+            self._converters.clear()
+
+    def stats(self):
+        """
+        Returns the hit, miss and eviction counters and the loaded model
+        files, least recently used first
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "loaded": list(self._converters),
+            }
@@ -2,15 +2,154 @@
 Library for converting a running configuration to Netconf XML.
 """
 
+import collections
+import copy
+import hashlib
+import multiprocessing
+import operator
+import os
+import pickle
+import re
+import tempfile
+import timeit
+
 from past.builtins import basestring
 from lxml import etree
 
 import yinsolidated
 
+from ote_utils.netconfutils import leafvalidation
+from ote_utils.netconfutils.leafvalidation import LeafValueError
+from ote_utils.ote_logger import OteLogger
+
+logger = OteLogger(__name__)
+
+MODEL_CACHE_VERSION = 6
+ROOT_NODE_ID = 0
+LEAF_KEYWORDS = ("leaf", "leaf-list", "case")
+CHOICE_KEYWORDS = ("choice", "case")
+OPERATIONS = ("delete", "create")
+NETCONF_NS = "urn:ietf:params:xml:ns:netconf:base:1.0"
+LEAFREF_PREDICATE_PATTERN = re.compile(r"\[[^\]]*\]")
+QUOTED_TOKEN_PATTERN = re.compile(r'"((?:[^"\\]|\\.)*)"|(\S+)')
+ESCAPE_PATTERN = re.compile(r'\\(["\\])')
+_get_window_tokens = operator.itemgetter(2)
+
 
 class ConfigParseError(RuntimeError):
 
-    "Exception class for errors while parsing configuration"
+    """
+    Exception class for errors while parsing configuration. An error on a
+    config line carries its line_number, the offending token and its column
+    in the line, and the path of the config objects enclosing it. When all
+    errors of a conversion are collected, errors holds one ConfigParseError
+    per failing line.
+    """
+
+    def __init__(
+        self, message, line_number=None, column=None, path=None, token=None, errors=()
+    ):
+        super(ConfigParseError, self).__init__(message)
+        self.message = message
+        self.reason = message
+        self.line_number = line_number
+        self.column = column
+        self.path = path
+        self.token = token
+        self.errors = list(errors)
+
+    @classmethod
+    def at_line(cls, reason, line_number=None, column=None, path=None, token=None):
+        """
+        Returns an error for a config line with the location in its message
+
+        Args:
+            reason (str): description of the error
+            line_number (int): 1-based number of the failing line
+            column (int): 1-based column of token in the line
+            path (str): '/' separated names of the enclosing config objects
+            token (str): the offending token
+        """
+        location = []
+        if line_number is not None:
+            location.append("line {}".format(line_number))
+        if column is not None:
+            location.append("column {}".format(column))
+        message = "Error parsing config"
+        if location:
+            message += " " + ", ".join(location)
+        if path:
+            message += " in " + path
+        error = cls(message + ": " + reason, line_number, column, path, token)
+        error.reason = reason
+        return error
+
+    def relocate(self, line_number):
+        """
+        Returns a copy of a line error reported at another line number
+        """
+        return ConfigParseError.at_line(
+            self.reason, line_number, self.column, self.path, self.token
+        )
+
+    def __reduce__(self):
+        return (
+            _restore_config_parse_error,
+            (self.__dict__.copy(),),
+        )
+
+
+def _restore_config_parse_error(state):
+    error = ConfigParseError(state["message"])
+    error.__dict__.update(state)
+    return error
+
+
+class XmlFileBuilder(object):
+
+    """
+    Serializes elements incrementally to a file-like object. Exposes the
+    start/data/end/close subset of etree.TreeBuilder used by NetconfConverter,
+    so a conversion can be written out as it is consumed instead of being
+    built as a tree in memory.
+    """
+
+    def __init__(self, output):
+        self._xmlfile = etree.xmlfile(output)
+        self._writer = self._xmlfile.__enter__()
+        self._elements = []
+        self._scopes = [{}]
+
+    def start(self, tag, attrib, nsmap=None):
+        scope = self._scopes[-1]
+        new_nsmap = {}
+        for prefix, ns in (nsmap or {}).items():
+            if scope.get(prefix) != ns:
+                new_nsmap[prefix] = ns
+        if new_nsmap:
+            scope = dict(scope)
+            scope.update(new_nsmap)
+
+        element = self._writer.element(tag, attrib, new_nsmap)
+        element.__enter__()
+        self._elements.append((tag, element))
+        self._scopes.append(scope)
+
+    def data(self, data):
+        if self._elements:
+            self._writer.write(data)
+
+    def end(self, tag):
+        start_tag, element = self._elements.pop()
+        if start_tag != tag:
+            raise ValueError("Unexpected end tag {}, expected {}".format(tag, start_tag))
+        self._scopes.pop()
+        element.__exit__(None, None, None)
+
+    def close(self):
+        if self._elements:
+            raise ValueError("Unclosed element {}".format(self._elements[-1][0]))
+        self._xmlfile.__exit__(None, None, None)
 
 
 class NetconfConverter(object):
@@ -21,20 +160,115 @@ class NetconfConverter(object):
 
     YIN_NAMESPACE = "urn:ietf:params:xml:ns:yang:yin:1"
     IDENTITY_TAG = str(etree.QName(YIN_NAMESPACE, "identity"))
-    IDENTITY_MAP = {}
+    KEY_TAG = str(etree.QName(YIN_NAMESPACE, "key"))
     operation_elem_name = etree.QName(
         "urn:ietf:params:xml:ns:netconf:base:1.0", "operation"
     )
 
-    def load_config_model(self, config_model_file):
+    def __init__(self, subtree_cache=None, profiler=None, validator=None):
+        """
+        Args:
+            subtree_cache (SubtreeCache): optional cache of converted config
+                blocks, reused by every conversion with this converter
+            profiler (ConversionProfiler): optional collector of per-phase
+                timers and counters; conversions are not instrumented when None
+            validator (LeafValidator): optional validator of leaf values
+                against their types in the model
+        """
+        self._model = None
+        self._model_file = None
+        self._identities = frozenset()
+        self._schema_nodes = None
+        self._leafref_targets = {}
+        self.subtree_cache = subtree_cache
+        self.profiler = profiler
+        self.validator = validator
+
+    @property
+    def model(self):
+        """
+        The parsed yinsolidated model. Conversion only uses the compiled
+        schema, so the parsed tree is released once a model is loaded and
+        the model file is parsed again on first access.
+        """
+        if self._model is None and self._model_file is not None:
+            self._model = yinsolidated.parse(self._model_file)
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        self._model = model
+
+    def __getstate__(self):
+        # The parsed model is not picklable; it is parsed again from the
+        # model file on first access after unpickling. The subtree cache,
+        # which holds QName objects, and the profiler stay with the original,
+        # so a pickled copy such as a worker process's starts without them.
+        state = self.__dict__.copy()
+        state["_model"] = None
+        state["subtree_cache"] = None
+        state["profiler"] = None
+        return state
+
+    def copy(self, subtree_cache=None, profiler=None, validator=None):
+        """
+        Returns a new converter sharing this converter's compiled model but
+        with its own subtree cache, profiler and validator, so a model loaded
+        once can be used by several owners without sharing their settings
+
+        Args:
+            subtree_cache (SubtreeCache): cache for the new converter
+            profiler (ConversionProfiler): profiler for the new converter
+            validator (LeafValidator): validator for the new converter
+        """
+        converter = NetconfConverter(subtree_cache, profiler, validator)
+        converter._model_file = self._model_file
+        converter._identities = self._identities
+        converter._schema_nodes = self._schema_nodes
+        converter._model_index = self._model_index
+        return converter
+
+    def load_config_model(self, config_model_file, cache_dir=None):
         """
         Parses the specified Netconf xml Consolidated Config Model file
 
         Args:
             config_model_file (str): Consolidated model Config xml file
+            cache_dir (str): optional directory holding compiled copies of the
+                model lookup tables, keyed by model file hash and mtime
         """
-        self.model = yinsolidated.parse(config_model_file)
-        self._find_identities()
+        profiler = self.profiler
+        if profiler is not None:
+            start = timeit.default_timer()
+
+        self._model = None
+        self._model_file = config_model_file
+        self._clear_model_caches()
+
+        cache_file = None
+        if cache_dir is not None:
+            cache_file = self._get_model_cache_file(config_model_file, cache_dir)
+            if self._load_model_cache(cache_file):
+                if profiler is not None:
+                    profiler.count("model_cache_hits")
+                    profiler.add_time("model_load", timeit.default_timer() - start)
+                return
+            if profiler is not None:
+                profiler.count("model_cache_misses")
+
+        if profiler is None:
+            self._build_model_index()
+            self._find_identities()
+        else:
+            profiler.time_call("model_parse", lambda: self.model)
+            profiler.time_call("model_index", self._build_model_index)
+            profiler.time_call("identities", self._find_identities)
+        self._model = None
+
+        if cache_file is not None:
+            self._save_model_cache(cache_file)
+        if profiler is not None:
+            profiler.add_time("model_load", timeit.default_timer() - start)
 
     def load_user_model(self, user_model_file):
         """
@@ -43,135 +277,1022 @@ class NetconfConverter(object):
         Args:
             config_model_file (str): Consolidated model User xml file
         """
+        self._model_file = user_model_file
+        self._clear_model_caches()
         self.model = yinsolidated.parse(user_model_file)
+        self._build_model_index()
+        self._identities = frozenset()
+        self._model = None
+
+    def _clear_model_caches(self):
+        self._schema_nodes = None
+        self._leafref_targets = {}
+        if self.subtree_cache is not None:
+            self.subtree_cache.clear()
 
-    def convert_config_to_netconf_xml(self, config_string_or_list, tag, attributes={}):
+    def convert_config_to_netconf_xml(
+        self,
+        config_string_or_list,
+        tag,
+        attributes={},
+        output=None,
+        pretty=True,
+        collect_errors=False,
+    ):
         """
         Converts a running configuration to Netconf XML. If specified as a
         string, each line of the string should contain a single config command.
-        If specified as a list, it should contain one config line per item. The
-        first line of either format must be 'config' with a matching 'exit' at
-        the end.  Each object specified should be terminated with an 'exit'.
+        Otherwise it may be a list, an open file or any other iterable yielding
+        one config line per item; lines are consumed lazily so the whole config
+        never has to be held in memory. The first line of either format must be
+        'config' with a matching 'exit' at the end.  Each object specified
+        should be terminated with an 'exit'.
 
         Args:
-            config_string_or_list (str/array): Config to convert to xml based on model
+            config_string_or_list (str/iterable): Config to convert to xml based on model
             tag (str): custom tag to add to xml block
             attributes (str): custom attr of starting tags in built netconf
+            output (file): optional binary file-like object; when given, the
+                xml is streamed to it as the config is consumed and None is
+                returned instead of the root element
+            pretty (bool): when False, no indentation or newline text is added
+                between elements; use pretty_print when serializing instead
+            collect_errors (bool): when True, conversion continues past lines
+                that fail, skipping the block they open, and a single
+                ConfigParseError listing every failing line in its errors is
+                raised at the end; any streamed output is then incomplete.
+                Skipped blocks are found by indentation, so unindented input
+                stops at the first failing line that is not a known leaf
         """
         if isinstance(config_string_or_list, basestring):
-            config_list = self._convert_config_string_to_list(config_string_or_list)
+            config_list = config_string_or_list.splitlines()
         else:
             config_list = config_string_or_list
 
-        return self._convert_config_list_to_netconf_xml(config_list, tag, attributes)
+        return self._convert_config_list_to_netconf_xml(
+            config_list, tag, attributes, output, pretty, collect_errors
+        )
+
+    def convert_many(self, configs, tag="config", attributes={}):
+        """
+        Converts several configurations with the loaded model, yielding a
+        (root element, error) tuple for each one in input order. A config
+        that fails to convert yields (None, ConfigParseError) and the
+        remaining configs are still converted.
+
+        Args:
+            configs (iterable): configs accepted by convert_config_to_netconf_xml
+            tag (str): custom tag to add to each xml block
+            attributes (str): custom attr of starting tags in built netconf
+        """
+        for config in configs:
+            try:
+                yield self.convert_config_to_netconf_xml(config, tag, attributes), None
+            except ConfigParseError as e:
+                yield None, e
+
+    def convert_config_to_netconf_xml_parallel(
+        self,
+        config_string_or_list,
+        tag,
+        attributes={},
+        processes=None,
+        pretty=True,
+        context=None,
+    ):
+        """
+        Converts a running configuration to Netconf XML like
+        convert_config_to_netconf_xml, but splits the config at the top-level
+        objects under 'authority' (each router, service, tenant, ...) and
+        converts those chunks in a pool of worker processes. The results are
+        joined back into a single document in the original order. Configs that
+        cannot be split this way are converted serially, as are all configs
+        when leafrefs are validated, since they may refer across chunks.
+        Workers convert without the subtree cache or profiler; the profiler
+        records the whole parallel conversion as one.
+
+        Args:
+            config_string_or_list (str/iterable): Config to convert to xml based on model
+            tag (str): custom tag to add to xml block
+            attributes (str): custom attr of starting tags in built netconf
+            processes (int): number of worker processes (default: cpu count)
+            pretty (bool): when False, no indentation or newline text is added
+                between elements
+            context (multiprocessing context): context to start the workers
+                with, e.g. multiprocessing.get_context("spawn") (default: the
+                multiprocessing module's start method)
+        """
+        if isinstance(config_string_or_list, basestring):
+            config_list = config_string_or_list.splitlines()
+        else:
+            config_list = list(config_string_or_list)
+
+        split_config = None
+        if self.validator is None or not self.validator.check_leafrefs:
+            split_config = self._split_config_at_authority(config_list)
+        if split_config is None or len(split_config[1]) < 2:
+            return self._convert_config_list_to_netconf_xml(
+                config_list, tag, attributes, pretty=pretty
+            )
+
+        head, chunks, tail = split_config
+        tasks = []
+        for chunk in chunks:
+            numbered_lines = head + chunk + tail
+            tasks.append((
+                [line for _, line in numbered_lines],
+                [line_number for line_number, _ in numbered_lines],
+                tag,
+                attributes,
+                pretty,
+            ))
+
+        profiler = self.profiler
+        if profiler is not None:
+            start = timeit.default_timer()
+        pool = (context or multiprocessing).Pool(
+            processes, initializer=_init_conversion_worker, initargs=(self,)
+        )
+        try:
+            results = pool.map(_convert_config_chunk, tasks)
+            pool.close()
+        except Exception:
+            pool.terminate()
+            if profiler is not None:
+                profiler.count("failed_conversions")
+            raise
+        finally:
+            pool.join()
+
+        root = etree.fromstring(results[0])
+        authority = root[0][0]
+        for result in results[1:]:
+            chunk_authority = etree.fromstring(result)[0][0]
+            authority[-1].tail = authority.text
+            authority.extend(list(chunk_authority))
+        if profiler is not None:
+            profiler.count("lines", len(head) + sum(map(len, chunks)) + len(tail))
+            profiler.count("parallel_chunks", len(tasks))
+            profiler.end_conversion(timeit.default_timer() - start)
+        return root
+
+    def _split_config_at_authority(self, config_list):
+        """
+        Splits config lines into the lines opening 'config' and 'authority',
+        the chunks of lines for each top-level object under authority (with
+        consecutive leaf lines grouped into one chunk) and the closing lines.
+        Each line is returned as a (line number, line) tuple. Returns None
+        when the config does not have that shape.
+        """
+        head = []
+        chunks = []
+        chunk_is_block = []
+        tail = []
+        stack = []
+        for line_number, config_line in enumerate(config_list, start=1):
+            stripped_line = config_line.strip()
+            if self._is_line_empty_or_comment(stripped_line):
+                continue
+            operation, name, _ = tokenize_config_line(stripped_line)
+            numbered_line = (line_number, config_line)
+            depth = len(stack)
+            is_exit = name == "exit" and operation is None
+            if is_exit:
+                if not stack:
+                    return None
+                stack.pop()
+            else:
+                parent_id = stack[-1] if stack else ROOT_NODE_ID
+                node_id = self._model_index.get((parent_id, name))
+                if node_id is None:
+                    return None
+                if self._schema_nodes[node_id].keyword not in LEAF_KEYWORDS:
+                    stack.append(node_id)
+
+            if depth > 2:
+                chunks[-1].append(numbered_line)
+            elif depth == 2 and not is_exit:
+                starts_block = len(stack) > depth
+                if starts_block or not chunks or chunk_is_block[-1]:
+                    chunks.append([])
+                    chunk_is_block.append(starts_block)
+                chunks[-1].append(numbered_line)
+            elif len(head) < 2 and not chunks:
+                head.append(numbered_line)
+            else:
+                tail.append(numbered_line)
+
+        if (
+            stack
+            or [line.split() for _, line in head][:1] != [["config"]]
+            or len(head) != 2
+            or head[1][1].split()[0] != "authority"
+            or [line.split() for _, line in tail] != [["exit"], ["exit"]]
+        ):
+            return None
+        return head, chunks, tail
+
+    def convert_netconf_xml_to_config(self, source, output=None):
+        """
+        Converts Netconf XML, for example a running config retrieved with
+        get_config, back to flat-text config in the format accepted by
+        convert_config_to_netconf_xml. The xml is read incrementally, so large
+        documents are never held in memory as a full tree. Elements wrapping
+        the model's top-level 'config' container (such as rpc-reply or data)
+        are skipped.
+
+        Args:
+            source (str/file/element): xml file name, binary file-like object
+                or an already parsed element
+            output (file): optional text file-like object to write the config
+                lines to; when not given the config is returned as a string
+        """
+        lines = self.iterate_netconf_xml_as_config(source)
+        if output is None:
+            return "\n".join(lines)
+
+        for line_number, line in enumerate(lines):
+            if line_number:
+                output.write("\n")
+            output.write(line)
+
+    def iterate_netconf_xml_as_config(self, source):
+        """
+        Generator yielding the flat-text config lines for Netconf XML. See
+        convert_netconf_xml_to_config for the accepted sources.
+
+        Args:
+            source (str/file/element): xml file name, binary file-like object
+                or an already parsed element
+        """
+        if etree.iselement(source):
+            events = etree.iterwalk(source, events=("start", "end"))
+            clear_elements = False
+        else:
+            events = etree.iterparse(source, events=("start", "end"))
+            clear_elements = True
+
+        config_tag = self._get_config_root_tag()
+        frames = []
+        lines = []
+        for event, elem in events:
+            if not frames and elem.tag != config_tag:
+                continue
+            if event == "start":
+                self._start_config_frame(frames, elem, lines)
+            else:
+                self._end_config_frame(frames, elem, lines)
+                if clear_elements:
+                    elem.clear()
+                    while elem.getprevious() is not None:
+                        del elem.getparent()[0]
+
+            for line in lines:
+                yield line
+            del lines[:]
+
+    def _get_config_root_tag(self):
+        config_id = self._find_child_node(ROOT_NODE_ID, "config")
+        return str(etree.QName(self._schema_nodes[config_id].namespace, "config"))
+
+    def _start_config_frame(self, frames, elem, lines):
+        qname = etree.QName(elem)
+        parent = frames[-1] if frames else None
+        parent_id = parent.node_id if parent else ROOT_NODE_ID
+        node_id = self._model_index.get((parent_id, qname.localname))
+        if node_id is None or self._schema_nodes[node_id].namespace != qname.namespace:
+            raise ConfigParseError(
+                "Element {} does not exist in the data model".format(elem.tag)
+            )
+        node = self._schema_nodes[node_id]
+        keyword = node.keyword
+        operation = elem.get(NetconfConverter.operation_elem_name)
+        if operation not in OPERATIONS:
+            operation = None
+
+        if parent is not None and parent.keys_pending and not parent.is_pending_key(
+            qname.localname
+        ):
+            lines.extend(parent.flush_header())
+
+        frame = _ConfigFrame(
+            qname.localname,
+            keyword,
+            node_id,
+            len(frames),
+            operation,
+            node.keys,
+        )
+        if not frame.keys_pending and keyword not in LEAF_KEYWORDS:
+            lines.append(frame.format_line(frame.name))
+        frames.append(frame)
+
+    def _end_config_frame(self, frames, elem, lines):
+        frame = frames.pop()
+        if frame.keyword not in LEAF_KEYWORDS:
+            lines.extend(frame.flush_header())
+            lines.append(frame.format_line("exit", with_operation=False))
+            return
+
+        value = elem.text
+        if value is not None:
+            value = self._strip_identity_prefix(value, elem)
+        line = frame.format_line(frame.name, value)
+        parent = frames[-1] if frames else None
+        if parent is not None and parent.keys_pending:
+            parent.add_key(frame.name, value, line)
+            if not parent.keys_pending:
+                lines.extend(parent.flush_header())
+        else:
+            lines.append(line)
+
+    def _strip_identity_prefix(self, value, elem):
+        prefix, sep, name = value.partition(":")
+        if sep and (elem.nsmap.get(prefix), name) in self._identities:
+            return name
+        return value
+
+    def diff_netconf_xml(self, current, desired, tag="config", attributes={}, partial=False):
+        """
+        Compares two Netconf XML configs, for example the running config and
+        the output of convert_config_to_netconf_xml, and builds the minimal
+        edit-config payload that turns current into desired. List entries are
+        matched by their keys from the data model. Entries and subtrees only
+        in desired are sent with operation="create", those only in current
+        with operation="delete" and changed leaves are merged. Elements of
+        desired which already carry an operation keep it; those marked
+        delete are only sent if they exist in current. Returns None when the
+        configs are the same.
+
+        With partial, desired may hold only part of the config: each list
+        entry in it, such as a router or service, replaces the entry in
+        current, but entries and leaves only in current outside of the list
+        entries in desired are kept instead of deleted.
+
+        Args:
+            current (element): current config, or an element containing it
+            desired (element): desired config, or an element containing it
+            tag (str): custom tag for the payload root
+            attributes (str): custom attr of the payload root
+            partial (bool): only delete within the list entries of desired
+        """
+        config_tag = self._get_config_root_tag()
+        current_config = self._find_config_root(current, config_tag)
+        desired_config = self._find_config_root(desired, config_tag)
+
+        config_id = self._find_child_node(ROOT_NODE_ID, "config")
+        changes = self._diff_children(current_config, desired_config, config_id, not partial)
+        if not changes:
+            return None
+
+        root = etree.Element(
+            etree.QName("urn:ietf:params:xml:ns:netconf:base:1.0", tag), attributes
+        )
+        config = etree.SubElement(root, config_tag, nsmap=desired_config.nsmap)
+        config.extend(changes)
+        return root
+
+    def _find_config_root(self, tree, config_tag):
+        if tree.tag == config_tag:
+            return tree
+        config = next(tree.iter(config_tag), None)
+        if config is None:
+            raise ConfigParseError("No {} element found".format(config_tag))
+        return config
+
+    def _diff_children(self, current, desired, node_id, delete_missing=True):
+        current_children = self._index_diff_children(current, node_id)
+        desired_children = self._index_diff_children(desired, node_id)
+
+        changes = []
+        for key, (desired_child, keyword, child_id) in desired_children.items():
+            operation = desired_child.get(NetconfConverter.operation_elem_name)
+            if operation == "delete":
+                # A delete line in the desired config only needs sending if
+                # there is something to delete.
+                if key in current_children:
+                    changes.append(self._copy_for_edit(desired_child))
+                continue
+            if key not in current_children:
+                change = self._copy_for_edit(desired_child, operation or "create")
+                self._drop_deletes(change)
+                changes.append(change)
+                continue
+            current_child = current_children[key][0]
+            if keyword in LEAF_KEYWORDS:
+                if (current_child.text or "") != (desired_child.text or ""):
+                    changes.append(self._copy_for_edit(desired_child))
+                continue
+            child_changes = self._diff_children(
+                current_child, desired_child, child_id, delete_missing or keyword == "list"
+            )
+            if child_changes:
+                change = etree.Element(desired_child.tag, nsmap=desired_child.nsmap)
+                change.extend(self._copy_list_keys(desired_child, child_id))
+                change.extend(child_changes)
+                changes.append(change)
+
+        if not delete_missing:
+            return changes
+        for key, (current_child, keyword, child_id) in current_children.items():
+            if key not in desired_children:
+                change = etree.Element(current_child.tag, nsmap=current_child.nsmap)
+                if keyword == "leaf-list":
+                    change.text = current_child.text
+                change.extend(self._copy_list_keys(current_child, child_id))
+                change.set(NetconfConverter.operation_elem_name, "delete")
+                changes.append(change)
+        return changes
+
+    def _index_diff_children(self, parent, node_id):
+        children = collections.OrderedDict()
+        for child in parent:
+            if not isinstance(child.tag, basestring):
+                continue
+            qname = etree.QName(child)
+            child_id = self._model_index.get((node_id, qname.localname))
+            if child_id is None:
+                path = "/".join(
+                    etree.QName(elem).localname
+                    for elem in reversed([child] + list(child.iterancestors()))
+                    if etree.QName(elem).namespace != NETCONF_NS
+                )
+                raise ConfigParseError(
+                    "Element {} does not exist in the data model".format(path),
+                    path=path,
+                    token=qname.localname,
+                )
+            child_node = self._schema_nodes[child_id]
+            keyword = child_node.keyword
+            if keyword == "leaf-list":
+                key = (child.tag, child.text)
+            elif child_node.keys:
+                key = (child.tag,) + tuple(
+                    child.findtext("{*}" + key_name) for key_name in child_node.keys
+                )
+            else:
+                key = child.tag
+            children[key] = (child, keyword, child_id)
+        return children
+
+    def _copy_list_keys(self, entry, node_id):
+        keys = []
+        for key_name in self._schema_nodes[node_id].keys:
+            key = entry.find("{*}" + key_name)
+            if key is not None:
+                keys.append(self._copy_for_edit(key))
+        return keys
+
+    def _copy_for_edit(self, elem, operation=None):
+        elem_copy = copy.deepcopy(elem)
+        for descendant in elem_copy.iter():
+            descendant.tail = None
+            if len(descendant) and descendant.text and not descendant.text.strip():
+                descendant.text = None
+        if operation is not None:
+            elem_copy.set(NetconfConverter.operation_elem_name, operation)
+        return elem_copy
+
+    def _drop_deletes(self, elem):
+        # Nothing under a newly created subtree exists yet to be deleted.
+        for descendant in list(elem.iterdescendants()):
+            if descendant.get(NetconfConverter.operation_elem_name) == "delete":
+                descendant.getparent().remove(descendant)
 
-    def _convert_config_list_to_netconf_xml(self, config_list, tag, attributes):
+    def _convert_config_list_to_netconf_xml(
+        self, config_list, tag, attributes, output=None, pretty=True, collect_errors=False
+    ):
 
-        builder = etree.TreeBuilder()
+        profiler = self.profiler
+        if profiler is not None:
+            start = timeit.default_timer()
+
+        if output is None:
+            builder = etree.TreeBuilder()
+        else:
+            builder = XmlFileBuilder(output)
+        if profiler is not None:
+            builder = _ProfilingBuilder(builder, profiler)
         config_elem_name = etree.QName("urn:ietf:params:xml:ns:netconf:base:1.0", tag)
         builder.start(config_elem_name, attributes)
-        builder.data("\n")
+        if pretty:
+            builder.data("\n")
 
         current_xml_token_stack = []
-        config_line = "(start)"
+        errors = []
+        validator = self.validator
+        check_leafrefs = validator is not None and validator.check_leafrefs
 
         try:
-            for line_number, config_line in enumerate(config_list, start=1):
-                if not self._is_line_empty_or_comment(config_line):
-                    self._process_config_line(
-                        builder, current_xml_token_stack, config_line
+            if check_leafrefs:
+                validator.begin()
+                config_list = self._track_config_lines(config_list)
+            if collect_errors:
+                self._process_config_lines_collecting_errors(
+                    builder, current_xml_token_stack, config_list, pretty, errors
+                )
+            # Replayed blocks skip the per-line processing that validation
+            # hooks into, so memoization is only used without a validator.
+            elif self.subtree_cache is not None and validator is None:
+                self._process_memoized_config_lines(
+                    builder, current_xml_token_stack, config_list, pretty
+                )
+            elif profiler is not None:
+                self._process_profiled_config_lines(
+                    builder, current_xml_token_stack, config_list, pretty
+                )
+            else:
+                self._process_config_lines(
+                    builder, current_xml_token_stack, config_list, pretty
+                )
+            if current_xml_token_stack:
+                missing_exit = ConfigParseError.at_line(
+                    "Missing exit",
+                    path=self._get_stack_path(current_xml_token_stack),
+                )
+                if not collect_errors:
+                    raise missing_exit
+                errors.append(missing_exit)
+            if check_leafrefs:
+                for leafref_error, (line_number, raw_line, leaf_stack) in validator.finish():
+                    error = self._get_config_line_error(
+                        leafref_error, line_number, raw_line, leaf_stack
                     )
+                    if not collect_errors:
+                        raise error
+                    errors.append(error)
+            if errors:
+                raise self._get_collected_error(errors)
             builder.end(config_elem_name)
-            builder.data("\n")
+            if pretty:
+                builder.data("\n")
             root = builder.close()
+        except ConfigParseError:
+            if profiler is not None:
+                profiler.count("failed_conversions")
+            raise
         except Exception as e:
+            if profiler is not None:
+                profiler.count("failed_conversions")
             raise ConfigParseError("Error parsing config " + str(e))
+        if profiler is not None:
+            profiler.end_conversion(timeit.default_timer() - start)
         return root
 
-    def _process_config_line(self, builder, stack, config_line):
-        tokens = config_line.split()
-
-        start_token = 0
-        end_token = 0
-        if len(tokens) > 1:
-            start_token = 1
-            end_token = len(tokens) - 1
-
-        if tokens[start_token].startswith('"') and tokens[end_token].endswith('"'):
-            tokens[start_token] = tokens[start_token][1:]
-            tokens[end_token] = tokens[end_token][:-1]
-
-        if tokens[0] == "exit":
-            self._process_exit_token(builder, stack)
-        elif tokens[0] == "delete":
-            del tokens[0]
-            self._process_config_tokens(builder, stack, tokens, "delete")
-        elif tokens[0] == "create":
-            del tokens[0]
-            self._process_config_tokens(builder, stack, tokens, "create")
+    def _track_config_lines(self, config_list):
+        # Keeps the number and text of the line being converted, which
+        # leafref references record to locate their errors.
+        for self._config_line in enumerate(config_list, start=1):
+            yield self._config_line[1]
+
+    def _process_config_lines(self, builder, stack, config_list, pretty):
+        line_number = 0
+        raw_line = None
+        try:
+            for line_number, raw_line in enumerate(config_list, start=1):
+                config_line = raw_line.strip()
+                if not self._is_line_empty_or_comment(config_line):
+                    self._process_config_line(builder, stack, config_line, pretty)
+        except Exception as e:
+            raise self._get_config_line_error(e, line_number, raw_line, stack)
+
+    def _process_config_lines_collecting_errors(
+        self, builder, stack, config_list, pretty, errors
+    ):
+        """
+        Converts config lines, adding an error for each failing line to errors
+        instead of stopping. The lines indented below a failing line, and the
+        exit closing them, are skipped as the block that line would open.
+        Blocks are only found by indentation, so collecting errors requires
+        indented input: a line failing inside the config without any
+        indentation stops the conversion with the errors found so far, unless
+        it is a known leaf, which opens no block.
+        """
+        skip_indent = None
+        skipped_block = False
+        for line_number, raw_line in enumerate(config_list, start=1):
+            config_line = raw_line.strip()
+            if self._is_line_empty_or_comment(config_line):
+                continue
+            indent = len(raw_line) - len(raw_line.lstrip())
+            if skip_indent is not None:
+                if indent > skip_indent:
+                    skipped_block = True
+                    continue
+                ends_skipped_block = (
+                    skipped_block and indent == skip_indent and config_line == "exit"
+                )
+                skip_indent = None
+                if ends_skipped_block:
+                    continue
+            try:
+                self._process_config_line(builder, stack, config_line, pretty)
+            except Exception as e:
+                errors.append(self._get_config_line_error(e, line_number, raw_line, stack))
+                if indent == 0 and stack and not self._is_leaf_line(stack, config_line):
+                    raise self._get_collected_error(errors)
+                skip_indent = indent
+                skipped_block = False
+
+    def _is_leaf_line(self, stack, config_line):
+        _, name, _ = tokenize_config_line(config_line)
+        node_id = self._model_index.get((stack[-1][1], name))
+        return node_id is not None and self._schema_nodes[node_id].keyword in LEAF_KEYWORDS
+
+    def _get_collected_error(self, errors):
+        return ConfigParseError(
+            "Error parsing config: {} errors\n{}".format(
+                len(errors), "\n".join(str(error) for error in errors)
+            ),
+            errors=errors,
+        )
+
+    def _get_config_line_error(self, error, line_number, config_line, stack):
+        if isinstance(error, ConfigParseError):
+            return error
+        token = column = None
+        if config_line is not None:
+            operation, name, value = tokenize_config_line(config_line.strip())
+            token = value if isinstance(error, LeafValueError) else name
+            start = len(config_line) - len(config_line.lstrip()) + len(operation or "")
+            position = config_line.find(token, start)
+            if position >= 0:
+                column = position + 1
+        return ConfigParseError.at_line(
+            str(error), line_number, column, self._get_stack_path(stack), token
+        )
+
+    def _get_stack_path(self, stack):
+        return "/".join(etree.QName(element_name).localname for element_name, _ in stack)
+
+    def _process_profiled_config_lines(self, builder, stack, config_list, pretty):
+        """
+        Converts config lines like the plain conversion loop while timing the
+        tokenize and lookup phases of each line. Time spent in the builder is
+        collected by the _ProfilingBuilder wrapping it and is taken out of the
+        lookup time.
+        """
+        profiler = self.profiler
+        timer = timeit.default_timer
+        tokenize_seconds = 0.0
+        lookup_seconds = 0.0
+        lines = 0
+        lookups = 0
+        build_seconds = profiler.timers["build"]
+        line_number = 0
+        raw_line = None
+        try:
+            for line_number, raw_line in enumerate(config_list, start=1):
+                config_line = raw_line.strip()
+                if self._is_line_empty_or_comment(config_line):
+                    continue
+                start = timer()
+                operation, name, value = tokenize_config_line(config_line)
+                tokenized = timer()
+                self._process_config_tokens_or_exit(
+                    builder, stack, name, value, operation, pretty
+                )
+                tokenize_seconds += tokenized - start
+                lookup_seconds += timer() - tokenized
+                lines += 1
+                if name != "exit" or operation is not None:
+                    lookups += 1
+        except Exception as e:
+            raise self._get_config_line_error(e, line_number, raw_line, stack)
+
+        lookup_seconds -= profiler.timers["build"] - build_seconds
+        profiler.add_time("tokenize", tokenize_seconds)
+        profiler.add_time("lookup", lookup_seconds)
+        profiler.count("lines", lines)
+        profiler.count("lookups", lookups)
+
+    def _process_memoized_config_lines(self, builder, stack, config_list, pretty):
+        """
+        Converts config lines, grafting the builder events of blocks that were
+        converted before at the same schema node and depth from the subtree
+        cache instead of converting them again. Only blocks at least
+        min_depth deep and between min_lines and max_lines long are cached,
+        so the config and authority blocks, which wrap the whole config, are
+        never recorded, and lines are only read ahead as far as max_lines.
+        """
+        cache = self.subtree_cache
+        profiler = self.profiler
+        if profiler is not None:
+            hits, misses = cache.hits, cache.misses
+        window_lines = self._iterate_window_lines(config_list)
+
+        # Builder events only go through the recorder while a block is being
+        # recorded. A block is keyed by its tokens, which together with the
+        # parent node and depth determine its output exactly.
+        recorder = _RecordingBuilder(builder)
+        recording = []
+        window = []
+        position = 0
+        while True:
+            if not window:
+                window_line = next(window_lines, None)
+                if window_line is None:
+                    break
+                window.append(window_line)
+            line_number, raw_line, (operation, name, value), block_lines = window[0]
+
+            if block_lines is None and len(stack) >= cache.min_depth:
+                block_lines = self._read_block(stack[-1][1], window, window_lines, cache.max_lines)
+            replayed = False
+            if block_lines and block_lines >= cache.min_lines:
+                key = (
+                    stack[-1][1],
+                    len(stack),
+                    pretty,
+                    tuple(map(_get_window_tokens, window[:block_lines])),
+                )
+                events = cache.get(key)
+                if events is None:
+                    if cache.should_record(key):
+                        recording.append((position + block_lines - 1, key, len(recorder.events)))
+                else:
+                    if recording:
+                        recorder.replay(events)
+                    else:
+                        _replay_events(builder, events)
+                    del window[:block_lines]
+                    position += block_lines - 1
+                    replayed = True
+
+            if not replayed:
+                del window[0]
+                try:
+                    self._process_config_tokens_or_exit(
+                        recorder if recording else builder, stack, name, value, operation, pretty
+                    )
+                except Exception as e:
+                    raise self._get_config_line_error(e, line_number, raw_line, stack)
+
+            while recording and recording[-1][0] == position:
+                _, key, start = recording.pop()
+                cache.put(key, tuple(recorder.events[start:]))
+            if not recording:
+                del recorder.events[:]
+            position += 1
+
+        if profiler is not None:
+            profiler.count("lines", position)
+            profiler.count("subtree_cache_hits", cache.hits - hits)
+            profiler.count("subtree_cache_misses", cache.misses - misses)
+
+    def _iterate_window_lines(self, config_list):
+        # Each line becomes [line number, raw line, tokens, block lines],
+        # where block lines is filled in by _read_block.
+        for line_number, raw_line in enumerate(config_list, start=1):
+            config_line = raw_line.strip()
+            if not self._is_line_empty_or_comment(config_line):
+                yield [line_number, raw_line, tokenize_config_line(config_line), None]
+
+    def _read_block(self, parent_id, window, window_lines, max_lines):
+        """
+        Returns the number of lines of the block opened by the first line of
+        window, reading further lines into window as needed, or 0 when that
+        line does not open a block or the block has more than max_lines
+        lines. The length of every block closed within those lines, or 0 for
+        the leaf and exit lines, is kept in its window line so those lines
+        are not read again.
+        """
+        openers = []
+        for index in range(max_lines):
+            if index == len(window):
+                window_line = next(window_lines, None)
+                if window_line is None:
+                    return 0
+                window.append(window_line)
+            operation, name, _ = window[index][2]
+            if name == "exit" and operation is None:
+                if not openers:
+                    return 0
+                opener, _ = openers.pop()
+                window[opener][3] = index - opener + 1
+                window[index][3] = 0
+                if not openers:
+                    return index + 1
+                continue
+            node_id = self._model_index.get((openers[-1][1] if openers else parent_id, name))
+            if node_id is None:
+                return 0
+            if self._schema_nodes[node_id].keyword not in LEAF_KEYWORDS:
+                openers.append((index, node_id))
+            elif not openers:
+                return 0
+            else:
+                window[index][3] = 0
+        return 0
+
+    def _process_config_line(self, builder, stack, config_line, pretty=True):
+        operation, name, value = tokenize_config_line(config_line)
+        self._process_config_tokens_or_exit(
+            builder, stack, name, value, operation, pretty
+        )
+
+    def _process_config_tokens_or_exit(
+        self, builder, stack, name, value, operation, pretty=True
+    ):
+        if name == "exit" and operation is None:
+            self._process_exit_token(builder, stack, pretty)
         else:
-            self._process_config_tokens(builder, stack, tokens)
+            self._process_config_tokens(builder, stack, name, value, operation, pretty)
 
-    def _process_config_tokens(self, builder, stack, tokens, operation=None):
-        first_token = tokens[0]
-        ns, prefix, yang_keyword = self._find_model_node(stack, first_token)
-        element_name = etree.QName(ns, first_token)
+    def _process_config_tokens(
+        self, builder, stack, name, value, operation=None, pretty=True
+    ):
+        parent_id = stack[-1][1] if stack else ROOT_NODE_ID
+        node_id = self._find_child_node(parent_id, name)
+        node = self._schema_nodes[node_id]
+        ns = node.namespace
+        prefix = node.prefix
+        element_name = etree.QName(ns, name)
 
-        self._add_indent(builder, stack)
-        elem = builder.start(element_name, {}, {prefix: ns})
+        is_leaf = node.keyword in LEAF_KEYWORDS
+        if is_leaf and value is not None and self.validator is not None:
+            self._validate_leaf_value(stack, node, node_id, name, value, operation)
 
-        if operation == "delete":
-            elem.set(NetconfConverter.operation_elem_name, "delete")
-        elif operation == "create":
-            elem.set(NetconfConverter.operation_elem_name, "create")
-
-        if yang_keyword in ["leaf", "leaf-list", "case"]:
-            if len(tokens) > 1:
-                if self._is_identity_type(tokens[1], ns):
-                    tokens[1] = prefix + ":" + tokens[1]
-                builder.data(" ".join(tokens[1:]))
+        attributes = {}
+        if operation is not None:
+            attributes[NetconfConverter.operation_elem_name] = operation
+
+        if pretty:
+            self._add_indent(builder, stack)
+        builder.start(element_name, attributes, {prefix: ns})
+
+        if is_leaf:
+            if value is not None:
+                if self._is_identity_type(value, ns):
+                    value = prefix + ":" + value
+                builder.data(value)
             builder.end(element_name)
-            builder.data("\n")
         else:
-            stack.append(first_token)
+            stack.append((element_name, node_id))
+        if pretty:
             builder.data("\n")
 
+    def _validate_leaf_value(self, stack, node, node_id, name, value, operation):
+        # Deletes may carry CLI options such as 'force' ahead of the value.
+        if operation == "delete":
+            return
+        leaf_validator = node.type
+        if leaf_validator is None:
+            return
+        try:
+            leaf_validator.validate(value)
+        except LeafValueError as e:
+            raise LeafValueError("Leaf {}: {}".format(name, e))
+
+        if not self.validator.check_leafrefs:
+            return
+        self.validator.record_value(node_id, value)
+        if leaf_validator.leafref_path is not None:
+            target_id = self._get_leafref_target(stack, node_id, leaf_validator.leafref_path)
+            if target_id is not None:
+                line_number, raw_line = self._config_line
+                self.validator.add_reference(
+                    target_id, value, name, (line_number, raw_line, list(stack))
+                )
+
+    def _get_leafref_target(self, stack, node_id, path):
+        """
+        Resolves a leafref path to the node id of the referenced leaf, or
+        None when it is outside the indexed config tree. Predicates are
+        ignored, so a value is accepted if any instance of the referenced
+        leaf has it.
+        """
+        if node_id not in self._leafref_targets:
+            if path.startswith("/"):
+                node_ids = [ROOT_NODE_ID]
+            else:
+                node_ids = [ROOT_NODE_ID] + [entry[1] for entry in stack] + [node_id]
+            for step in LEAFREF_PREDICATE_PATTERN.sub("", path).split("/"):
+                if not step:
+                    continue
+                if step == "..":
+                    node_ids.pop()
+                    continue
+                child_id = self._model_index.get((node_ids[-1], step.split(":")[-1]))
+                if child_id is None:
+                    node_ids = [None]
+                    break
+                node_ids.append(child_id)
+            self._leafref_targets[node_id] = node_ids[-1]
+        return self._leafref_targets[node_id]
+
+    def _find_child_node(self, parent_id, token):
+        node_id = self._model_index.get((parent_id, token))
+        if node_id is None:
+            raise Exception("Token {} does not exist in the data model".format(token))
+        return node_id
+
     def _find_model_node(self, stack, token):
         stack_copy = list(stack)
         if token is not None:
             stack_copy.append(token)
-        tree = self.model.getroot()
 
+        node_id = ROOT_NODE_ID
         for name in stack_copy:
-            tree = self.find_child(tree, name)
+            node_id = self._find_child_node(node_id, name)
 
-        if tree is None:
-            raise Exception("Token {} does not exist in the data model".format(token))
+        node = self._schema_nodes[node_id]
+        return node.namespace, node.prefix, node.keyword
 
-        return tree.namespace, tree.prefix, etree.QName(tree.tag).localname
+    def _build_model_index(self):
+        """
+        Compiles every schema node reachable from the model root into a
+        _SchemaNode holding its namespace, prefix, keyword, list keys and
+        compiled leaf type, stored in a list indexed by node id, and builds a
+        lookup table mapping (parent node id, child name) to the child node
+        id. Children of choice and case nodes are flattened into their
+        parent, following the same precedence as find_child, so each config
+        token resolves with a single lookup and the parsed model is not
+        needed after loading.
+        """
+        root = self.model.getroot()
+        self._model_index = {}
+        self._schema_nodes = [
+            _SchemaNode(root.get("name"), None, root.get("module-prefix"), "module")
+        ]
+        node_ids = {root: ROOT_NODE_ID}
+        self._index_model_node(root, root.get("module-prefix"), node_ids, {})
+
+    def _index_model_node(self, node, prefix, node_ids, type_cache):
+        node_id = node_ids[node]
+        named_children = self._collect_named_children(node, prefix)
+        for name, (child, child_prefix) in named_children.items():
+            keyword = etree.QName(child.tag).localname
+            is_new = child not in node_ids
+            if is_new:
+                node_ids[child] = len(node_ids)
+            child_id = node_ids[child]
+            self._model_index[(node_id, name)] = child_id
+            if is_new:
+                namespace = child.nsmap.get(child_prefix)
+                self._schema_nodes.append(
+                    self._compile_schema_node(
+                        child, name, namespace, child_prefix, keyword, type_cache
+                    )
+                )
+                if keyword not in LEAF_KEYWORDS:
+                    self._index_model_node(child, child_prefix, node_ids, type_cache)
+
+    def _compile_schema_node(self, node, name, namespace, prefix, keyword, type_cache):
+        keys = ()
+        leaf_type = None
+        if keyword == "list":
+            key = node.find(self.KEY_TAG)
+            key_names = key.get("value", "").split() if key is not None else []
+            keys = tuple(key_name.split(":")[-1] for key_name in key_names)
+        elif keyword in LEAF_KEYWORDS:
+            type_elem = node.find(leafvalidation.TYPE_TAG)
+            if type_elem is not None:
+                leaf_type = leafvalidation.compile_type(type_elem, type_cache)
+        return _SchemaNode(name, namespace, prefix, keyword, keys, leaf_type)
+
+    def _collect_named_children(self, node, prefix):
+        named_children = {}
+        choices = []
+        for child in node:
+            if not isinstance(child.tag, basestring):
+                continue
+            child_prefix = child.get("module-prefix", prefix)
+            name = child.get("name")
+            if name is not None and name not in named_children:
+                named_children[name] = (child, child_prefix)
+            if etree.QName(child.tag).localname in CHOICE_KEYWORDS:
+                choices.append((child, child_prefix))
+
+        for choice, choice_prefix in choices:
+            choice_children = self._collect_named_children(choice, choice_prefix)
+            for name, entry in choice_children.items():
+                named_children.setdefault(name, entry)
+        return named_children
 
     def find_child(self, tree, name):
-        node = tree.find("*/[@name='{}']".format(name))
-        if node is None:
-            for child in tree:
-                if etree.QName(child.tag).localname in ["choice", "case"]:
-                    node = self.find_child(child, name)
-                    if node is not None:
-                        return node
-        return node
-
-    def _process_exit_token(self, builder, stack):
-        token = stack[-1]
-        ns, _, _ = self._find_model_node(stack, None)
-        element_name = etree.QName(ns, token)
-        stack.pop()
-        self._add_indent(builder, stack)
-        builder.end(element_name)
-        builder.data("\n")
+        """
+        Returns the child schema node of tree with the given name, looking
+        into choice and case children when it is not a direct child, or None
+        when there is no such child. Conversion resolves tokens through the
+        model index instead, so this walks the parsed model on every call.
+
+        Args:
+            tree (element): schema node of the model
+            name (str): name of the child
+        """
+        child = self._collect_named_children(tree, None).get(name)
+        return None if child is None else child[0]
 
-    def _convert_config_string_to_list(self, config_str):
-        lines = config_str.splitlines()
-        return [line.strip() for line in lines]
+    def _process_exit_token(self, builder, stack, pretty=True):
+        if not stack:
+            raise ValueError("Unexpected exit with no open config object")
+        element_name, _ = stack.pop()
+        if pretty:
+            self._add_indent(builder, stack)
+        builder.end(element_name)
+        if pretty:
+            builder.data("\n")
 
     def _is_line_empty_or_comment(self, config_line):
         return (len(config_line) == 0) or (config_line[0] == "#")
@@ -181,18 +1302,418 @@ class NetconfConverter(object):
         builder.data(indent)
 
     def _find_identities(self):
-        identities = self.model.findall("/" + self.IDENTITY_TAG)
-        for child in identities:
-            self.IDENTITY_MAP[child.name] = {
-                "prefix": child.prefix,
-                "namespace": child.namespace,
-            }
+        identities = self.model.getroot().iterfind(self.IDENTITY_TAG)
+        self._identities = frozenset(
+            (child.namespace, child.name) for child in identities
+        )
+
+    def _get_model_cache_file(self, model_file, cache_dir):
+        digest = hashlib.sha1()
+        with open(model_file, "rb") as model:
+            for chunk in iter(lambda: model.read(1 << 16), b""):
+                digest.update(chunk)
+        digest.update(repr(os.path.getmtime(model_file)).encode("ascii"))
+        cache_name = "{}.{}.v{}.cache".format(
+            os.path.basename(model_file), digest.hexdigest(), MODEL_CACHE_VERSION
+        )
+        return os.path.join(cache_dir, cache_name)
+
+    def _load_model_cache(self, cache_file):
+        if not os.path.isfile(cache_file):
+            return False
+        try:
+            with open(cache_file, "rb") as cache:
+                cached = pickle.load(cache)
+            if cached["version"] != MODEL_CACHE_VERSION:
+                return False
+            model_index = cached["index"]
+            schema_nodes = cached["schema"]
+            identities = cached["identities"]
+        except Exception as e:
+            logger.warning("Ignoring unreadable model cache {}: {}".format(cache_file, e))
+            return False
+
+        logger.debug("Loaded model cache {}".format(cache_file))
+        self._model_index = model_index
+        self._schema_nodes = schema_nodes
+        self._identities = identities
+        return True
+
+    def _save_model_cache(self, cache_file):
+        cached = {
+            "version": MODEL_CACHE_VERSION,
+            "index": self._model_index,
+            "schema": self._schema_nodes,
+            "identities": self._identities,
+        }
+        cache_dir = os.path.dirname(cache_file)
+        temp_file = None
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            fd, temp_file = tempfile.mkstemp(dir=cache_dir)
+            with os.fdopen(fd, "wb") as cache:
+                pickle.dump(cached, cache, 2)
+            os.rename(temp_file, cache_file)
+        except (IOError, OSError) as e:
+            logger.warning("Unable to write model cache {}: {}".format(cache_file, e))
+            if temp_file is not None and os.path.exists(temp_file):
+                os.remove(temp_file)
 
     def _is_identity_type(self, token, namespace):
-        is_identity = False
+        return (namespace, token) in self._identities
+
+
+def tokenize_config_line(config_line):
+    """
+    Splits a config line into an (operation, name, value) tuple in a single
+    pass. operation is 'delete', 'create' or None and value is None when the
+    line has no value. A double-quoted value keeps its whitespace and may
+    escape quotes and backslashes with a backslash; any other backslash is
+    kept as it is. Runs of whitespace in an unquoted value are collapsed to
+    single spaces.
+
+    Args:
+        config_line (str): a single line of flat-text config
+    """
+    if '"' in config_line:
+        return _tokenize_quoted_config_line(config_line)
+
+    parts = config_line.split(None, 1)
+    operation = None
+    if parts[0] in OPERATIONS and len(parts) > 1:
+        operation = parts[0]
+        parts = parts[1].split(None, 1)
+
+    if len(parts) == 1:
+        return operation, parts[0], None
+    name, value = parts
+    value = value.rstrip()
+    if "  " in value or "\t" in value:
+        value = " ".join(value.split())
+    return operation, name, value
+
+
+def _tokenize_quoted_config_line(config_line):
+    tokens = []
+    for match in QUOTED_TOKEN_PATTERN.finditer(config_line):
+        quoted, bare = match.groups()
+        tokens.append(bare if bare is not None else ESCAPE_PATTERN.sub(r"\1", quoted))
+
+    operation = None
+    name_index = 0
+    if tokens[0] in OPERATIONS and len(tokens) > 1:
+        operation = tokens[0]
+        name_index = 1
+
+    value = None
+    if len(tokens) > name_index + 1:
+        value = " ".join(tokens[name_index + 1:])
+    return operation, tokens[name_index], value
+
+
+def quote_config_value(value):
+    """
+    Returns value as it should appear in a flat-text config line, quoting
+    and escaping it when it is empty or contains whitespace or quotes.
+
+    Args:
+        value (str): a leaf value
+    """
+    if value and not any(char.isspace() or char == '"' for char in value):
+        return value
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+class _SchemaNode(object):
+
+    """
+    Compiled schema node, keeping only what conversion and validation use:
+    keys are the key names of a list and type is the compiled type validator
+    of a leaf. This is the only per-node record; children are found through
+    the model index, which maps (parent node id, name) to a node id.
+    """
+
+    __slots__ = ("name", "namespace", "prefix", "keyword", "keys", "type")
+
+    def __init__(self, name, namespace, prefix, keyword, keys=(), type=None):
+        self.name = name
+        self.namespace = namespace
+        self.prefix = prefix
+        self.keyword = keyword
+        self.keys = keys
+        self.type = type
+
+
+class _ConfigFrame(object):
+
+    """
+    An element being written out by the xml to config conversion. A list
+    entry's header line is held back, along with its key leaf lines, until
+    all of its keys have been read.
+    """
+
+    __slots__ = (
+        "name", "keyword", "node_id", "depth", "operation", "keys",
+        "key_values", "key_lines", "keys_pending",
+    )
+
+    def __init__(self, name, keyword, node_id, depth, operation, keys):
+        self.name = name
+        self.keyword = keyword
+        self.node_id = node_id
+        self.depth = depth
+        self.operation = operation
+        self.keys = keys
+        self.key_values = {}
+        self.key_lines = []
+        self.keys_pending = bool(keys)
+
+    def format_line(self, name, value=None, with_operation=True):
+        line = "    " * self.depth
+        if with_operation and self.operation is not None:
+            line += self.operation + " "
+        line += name
+        if value is not None:
+            line += " " + quote_config_value(value)
+        return line
+
+    def is_pending_key(self, name):
+        return name in self.keys and name not in self.key_values
+
+    def add_key(self, name, value, line):
+        self.key_values[name] = value
+        self.key_lines.append(line)
+        if len(self.key_values) == len(self.keys):
+            self.keys_pending = False
+
+    def flush_header(self):
+        if not self.keys or self.key_lines is None:
+            return []
+
+        header = self.name
+        for key in self.keys:
+            value = self.key_values.get(key)
+            if value is not None:
+                header += " " + quote_config_value(value)
+        lines = [self.format_line(header)] + self.key_lines
+        self.keys_pending = False
+        self.key_lines = None
+        return lines
+
+
+class SubtreeCache(object):
+
+    """
+    Bounded cache of converted config blocks for NetconfConverter, keyed by
+    schema node, depth and the tokens of the block's lines. Least recently used
+    blocks are evicted once more than max_entries blocks or more than
+    max_events recorded builder events are held. Only blocks nested at least
+    min_depth deep with min_lines to max_lines lines are cached, and a block
+    is only recorded once it is seen again after a miss, so blocks that occur
+    once, such as most router entries, are converted without recording.
+    """
+
+    def __init__(
+        self, max_entries=1024, min_lines=4, max_lines=256, max_events=65536, min_depth=2
+    ):
+        self.max_entries = max_entries
+        self.min_lines = min_lines
+        self.max_lines = max_lines
+        self.max_events = max_events
+        self.min_depth = min_depth
+        self.hits = 0
+        self.misses = 0
+        self.events = 0
+        self._entries = collections.OrderedDict()
+        self._missed = collections.OrderedDict()
+
+    def get(self, key):
+        events = self._entries.pop(key, None)
+        if events is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries[key] = events
+        return events
+
+    def should_record(self, key):
+        """
+        Returns True if key was missed before; otherwise remembers the miss.
+        Misses are remembered by hash for the last 8 * max_entries keys, so a
+        collision only costs an unneeded recording.
+        """
+        key_hash = hash(key)
+        if key_hash in self._missed:
+            return True
+        self._missed[key_hash] = None
+        if len(self._missed) > 8 * self.max_entries:
+            self._missed.popitem(last=False)
+        return False
+
+    def put(self, key, events):
+        self._remove(key)
+        if len(events) > self.max_events:
+            return
+        self._entries[key] = events
+        self.events += len(events)
+        while len(self._entries) > self.max_entries or self.events > self.max_events:
+            _, evicted = self._entries.popitem(last=False)
+            self.events -= len(evicted)
+
+    def clear(self):
+        self._entries.clear()
+        self._missed.clear()
+        self.events = 0
+
+    def _remove(self, key):
+        events = self._entries.pop(key, None)
+        if events is not None:
+            self.events -= len(events)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ConversionProfiler(object):
+
+    """
+    Per-phase timers and counters for a NetconfConverter. Model loads record
+    model_load, model_parse, model_index and identities times and model cache
+    hits and misses; conversions record tokenize, lookup, build and convert
+    times, lines processed, model lookups and subtree cache hits and misses.
+    When log_stats is set the stats are logged after each conversion.
+    """
+
+    def __init__(self, log_stats=False):
+        self.log_stats = log_stats
+        self.reset()
+
+    def reset(self):
+        self.timers = collections.defaultdict(float)
+        self.counters = collections.defaultdict(int)
+
+    def add_time(self, phase, seconds):
+        self.timers[phase] += seconds
+
+    def time_call(self, phase, function):
+        start = timeit.default_timer()
         try:
-            if self.IDENTITY_MAP[token]["namespace"] == namespace:
-                is_identity = True
-        except KeyError:
-            pass
-        return is_identity
+            return function()
+        finally:
+            self.add_time(phase, timeit.default_timer() - start)
+
+    def count(self, name, increment=1):
+        self.counters[name] += increment
+
+    def end_conversion(self, seconds):
+        self.add_time("convert", seconds)
+        self.count("conversions")
+        if self.log_stats:
+            logger.info("Conversion stats: {}".format(self.stats()))
+
+    def stats(self):
+        """
+        Returns a dict of the timers in seconds, the counters and the hit rate
+        of each cache with recorded hits or misses
+        """
+        hit_rates = {}
+        for cache in ("model_cache", "subtree_cache"):
+            hits = self.counters.get(cache + "_hits", 0)
+            total = hits + self.counters.get(cache + "_misses", 0)
+            if total:
+                hit_rates[cache] = float(hits) / total
+        return {
+            "timers": dict(self.timers),
+            "counters": dict(self.counters),
+            "hit_rates": hit_rates,
+        }
+
+
+class _ProfilingBuilder(object):
+
+    """
+    Forwards builder calls to a builder, adding the time spent in them to the
+    build timer of a ConversionProfiler.
+    """
+
+    def __init__(self, builder, profiler):
+        self.builder = builder
+        self.timers = profiler.timers
+
+    def start(self, tag, attrib, nsmap=None):
+        start = timeit.default_timer()
+        self.builder.start(tag, attrib, nsmap)
+        self.timers["build"] += timeit.default_timer() - start
+
+    def data(self, data):
+        start = timeit.default_timer()
+        self.builder.data(data)
+        self.timers["build"] += timeit.default_timer() - start
+
+    def end(self, tag):
+        start = timeit.default_timer()
+        self.builder.end(tag)
+        self.timers["build"] += timeit.default_timer() - start
+
+    def close(self):
+        start = timeit.default_timer()
+        try:
+            return self.builder.close()
+        finally:
+            self.timers["build"] += timeit.default_timer() - start
+
+
+class _RecordingBuilder(object):
+
+    """
+    Forwards builder calls while recording them, so a converted block can be
+    stored in a SubtreeCache and replayed later.
+    """
+
+    def __init__(self, builder):
+        self.builder = builder
+        self.events = []
+
+    def start(self, tag, attrib, nsmap=None):
+        self.events.append(("start", (tag, attrib, nsmap)))
+        self.builder.start(tag, attrib, nsmap)
+
+    def data(self, data):
+        self.events.append(("data", (data,)))
+        self.builder.data(data)
+
+    def end(self, tag):
+        self.events.append(("end", (tag,)))
+        self.builder.end(tag)
+
+    def replay(self, events):
+        self.events.extend(events)
+        _replay_events(self.builder, events)
+
+
+def _replay_events(builder, events):
+    for method, args in events:
+        getattr(builder, method)(*args)
+
+
+_worker_converter = None
+
+
+def _init_conversion_worker(converter):
+    global _worker_converter
+    _worker_converter = converter
+
+
+def _convert_config_chunk(task):
+    config_list, line_numbers, tag, attributes, pretty = task
+    try:
+        root = _worker_converter._convert_config_list_to_netconf_xml(
+            config_list, tag, attributes, pretty=pretty
+        )
+    except ConfigParseError as e:
+        if e.line_number is None:
+            raise
+        # Report the line in the whole config rather than in the chunk.
+        raise e.relocate(line_numbers[e.line_number - 1])
+    return etree.tostring(root)
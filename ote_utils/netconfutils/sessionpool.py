@@ -0,0 +1,236 @@
+"""
+Pool of reusable NETCONF sessions, so repeated applies to the same router
+or conductor skip the SSH handshake and NETCONF hello exchange.
+"""
+
+import collections
+import contextlib
+import threading
+import time
+
+from ote_utils.ote_logger import OteLogger
+
+logger = OteLogger(__name__)
+
+SessionKey = collections.namedtuple("SessionKey", ["host", "port", "username", "key_filename"])
+
+
+class SessionPoolError(RuntimeError):
+
+    "Exception class for sessions that cannot be handed out by the pool"
+
+
+class NetconfSessionPool(object):
+
+    """
+    Keeps open ncclient sessions keyed by (host, port, username, key file).
+    A released session is kept idle for reuse until idle_timeout passes. A
+    session is only handed out again if it is still connected. At most
+    max_size sessions are open at once; when the pool is full the least
+    recently used idle session is closed to make room, or acquire waits for
+    a session to be released. Sessions are closed outside the pool's lock,
+    so a slow close-session rpc does not hold up other threads.
+    """
+
+    def __init__(self, max_size=8, idle_timeout=300, connect=None, **connect_args):
+        """
+        Args:
+            max_size (int): maximum number of open sessions
+            idle_timeout (float): seconds an unused session is kept open
+            connect (callable): opens a session given host, port, username
+                and key_filename keyword arguments; defaults to
+                ncclient.manager.connect
+            connect_args: extra keyword arguments passed to connect
+        """
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.connect_args = dict(
+            allow_agent=True, look_for_keys=False, hostkey_verify=False
+        )
+        self.connect_args.update(connect_args)
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+        self._connect = connect
+        self._idle = collections.OrderedDict()
+        self._in_use = {}
+        self._generation = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, host, port=830, username="admin", key_filename=None, timeout=None):
+        """
+        Returns an open session for the given router, reusing an idle one
+        when possible. Release it with release when done.
+
+        Args:
+            host (str): router or conductor address
+            port (int): NETCONF port
+            username (str): user to log in as
+            key_filename (str): private key file
+            timeout (float): seconds to wait when the pool is full (default:
+                wait until a session is released)
+        """
+        key = SessionKey(host, int(port), username, key_filename)
+        deadline = None if timeout is None else time.time() + timeout
+        closing = []
+        try:
+            with self._condition:
+                while True:
+                    closing.extend(self._pop_expired())
+                    session = self._take_idle(key, closing)
+                    if session is not None:
+                        self.reused += 1
+                        self._in_use[id(session)] = (key, self._generation)
+                        return session
+                    if len(self._idle) + len(self._in_use) < self.max_size:
+                        break
+                    if self._idle:
+                        _, (idle_session, _, _) = self._idle.popitem(last=False)
+                        closing.append(idle_session)
+                        break
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        raise SessionPoolError(
+                            "No NETCONF session available for {} within {}s".format(host, timeout)
+                        )
+                    self._condition.wait(remaining)
+                # Reserve the slot while connecting outside the lock.
+                reservation = object()
+                self._in_use[id(reservation)] = (key, self._generation)
+        finally:
+            self._close_sessions(closing)
+
+        try:
+            session = self._open(key)
+        except Exception:
+            with self._condition:
+                del self._in_use[id(reservation)]
+                self._condition.notify()
+            raise
+
+        with self._condition:
+            self._in_use[id(session)] = self._in_use.pop(id(reservation))
+            self.created += 1
+        return session
+
+    def release(self, session, discard=False):
+        """
+        Returns a session to the pool for reuse
+
+        Args:
+            session: a session from acquire
+            discard (bool): close the session instead of keeping it, for
+                example after an error left it in an unknown state
+        """
+        with self._condition:
+            key, generation = self._in_use.pop(id(session), (None, None))
+            if key is None:
+                raise SessionPoolError("Session was not acquired from this pool")
+            # Sessions acquired before close_all are closed, not kept.
+            keep = not discard and generation == self._generation
+            if keep and self._is_connected(session):
+                self._idle[id(session)] = (session, key, time.time())
+                session = None
+            elif generation == self._generation:
+                self.discarded += 1
+            self._condition.notify()
+        if session is not None:
+            self._close(session)
+
+    @contextlib.contextmanager
+    def session(self, host, port=830, username="admin", key_filename=None, timeout=None):
+        """
+        Context manager acquiring a session and releasing it on exit. The
+        session is discarded if the block raises.
+        """
+        session = self.acquire(host, port, username, key_filename, timeout)
+        try:
+            yield session
+        except BaseException:
+            self.release(session, discard=True)
+            raise
+        self.release(session)
+
+    def close_idle(self):
+        """
+        Closes all idle sessions
+        """
+        with self._condition:
+            closing = [session for session, _, _ in self._idle.values()]
+            self._idle.clear()
+            self._condition.notify_all()
+        self._close_sessions(closing)
+
+    def close_all(self):
+        """
+        Closes all idle sessions. Sessions in use are closed when their
+        holders release them.
+        """
+        with self._condition:
+            self._generation += 1
+        self.close_idle()
+
+    def stats(self):
+        """
+        Returns the created, reused and discarded counters and the number of
+        idle and in use sessions
+        """
+        with self._condition:
+            return {
+                "created": self.created,
+                "reused": self.reused,
+                "discarded": self.discarded,
+                "idle": len(self._idle),
+                "in_use": len(self._in_use),
+            }
+
+    def _take_idle(self, key, closing):
+        for session_id, (session, session_key, _) in list(self._idle.items()):
+            if session_key != key:
+                continue
+            del self._idle[session_id]
+            if self._is_connected(session):
+                return session
+            self.discarded += 1
+            closing.append(session)
+        return None
+
+    def _pop_expired(self):
+        expiry = time.time() - self.idle_timeout
+        expired = []
+        for session_id, (session, _, released) in list(self._idle.items()):
+            if released < expiry:
+                del self._idle[session_id]
+                expired.append(session)
+        return expired
+
+    def _open(self, key):
+        connect = self._connect
+        if connect is None:
+            from ncclient import manager
+
+            connect = manager.connect
+        logger.debug("Opening NETCONF session to {}:{}".format(key.host, key.port))
+        return connect(
+            host=key.host,
+            port=key.port,
+            username=key.username,
+            key_filename=key.key_filename,
+            **self.connect_args
+        )
+
+    def _is_connected(self, session):
+        return getattr(session, "connected", True)
+
+    def _close_sessions(self, sessions):
+        for session in sessions:
+            self._close(session)
+
+    def _close(self, session):
+        try:
+            if self._is_connected(session):
+                session.close_session()
+        except Exception as e:
+            logger.debug("Ignoring error closing NETCONF session: {}".format(e))
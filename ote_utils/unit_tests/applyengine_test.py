@@ -0,0 +1,118 @@
+import threading
+import time
+import unittest
+
+from ote_utils.netconfutils import applyengine
+from ote_utils.netconfutils import sessionpool
+
+
+class StubReply(object):
+    def __init__(self, ok=True):
+        self.ok = ok
+
+
+class StubSession(object):
+
+    "Stands in for an ncclient manager connected to a NETCONF server"
+
+    def __init__(self, fleet, host):
+        self.fleet = fleet
+        self.host = host
+        self.connected = True
+        self.timeout = None
+
+    def edit_config(self, target, config, **kwargs):
+        self.fleet.record(self.host, config)
+        if self.host in self.fleet.raising:
+            raise IOError("connection reset")
+        return StubReply(self.host not in self.fleet.rejecting)
+
+    def commit(self):
+        return StubReply(self.host not in self.fleet.rejecting_commit)
+
+    def discard_changes(self):
+        with self.fleet.lock:
+            self.fleet.discarded.append(self.host)
+        return StubReply()
+
+    def close_session(self):
+        self.connected = False
+
+
+class StubFleet(object):
+    def __init__(self, delay=0.0, rejecting=(), raising=(), rejecting_commit=()):
+        self.delay = delay
+        self.rejecting = set(rejecting)
+        self.raising = set(raising)
+        self.rejecting_commit = set(rejecting_commit)
+        self.payloads = {}
+        self.discarded = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def connect(self, host, **connect_args):
+        return StubSession(self, host)
+
+    def record(self, host, config):
+        with self.lock:
+            self.payloads[host] = config
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+
+
+class FleetApplierTestCase(unittest.TestCase):
+    def get_applier(self, fleet, **kwargs):
+        pool = sessionpool.NetconfSessionPool(max_size=4, connect=fleet.connect)
+        return applyengine.FleetApplier(max_workers=4, pool=pool, **kwargs)
+
+    def test_apply_to_fleet(self):
+        fleet = StubFleet(delay=0.02)
+        hosts = ["router{}".format(number) for number in range(12)]
+
+        results = self.get_applier(fleet).apply("<config/>", hosts)
+
+        self.assertEqual([result.host for result in results], hosts)
+        self.assertEqual(set(result.status for result in results), {applyengine.COMMITTED})
+        self.assertEqual(set(fleet.payloads.values()), {"<config/>"})
+        self.assertEqual(fleet.max_in_flight, 4)
+
+    def test_failed_hosts_reported(self):
+        fleet = StubFleet(rejecting=["router1"], raising=["router2"])
+
+        results = self.get_applier(fleet).apply("<config/>", ["router0", "router1", "router2"])
+
+        self.assertEqual(
+            [result.status for result in results],
+            [applyengine.COMMITTED, applyengine.FAILED, applyengine.FAILED],
+        )
+        self.assertEqual(results[1].error, "There was an error adding the candidate config")
+        self.assertTrue(results[2].error.endswith("Error: connection reset"))
+
+        table = applyengine.format_results(results).splitlines()
+        self.assertEqual(table[0].split(), ["HOST", "STATUS", "SECONDS", "ERROR"])
+        self.assertEqual(table[-1], "1 committed, 2 failed, 0 skipped")
+
+    def test_failed_hosts_discard_changes(self):
+        fleet = StubFleet(rejecting=["router1"], raising=["router2"], rejecting_commit=["router3"])
+        hosts = ["router{}".format(number) for number in range(4)]
+
+        results = self.get_applier(fleet).apply("<config/>", hosts)
+
+        self.assertEqual(results[3].error, "There was an error committing the config")
+        self.assertEqual(sorted(fleet.discarded), ["router1", "router2", "router3"])
+
+    def test_stop_on_failure_rate(self):
+        hosts = ["router{}".format(number) for number in range(20)]
+        fleet = StubFleet(rejecting=hosts)
+        pool = sessionpool.NetconfSessionPool(max_size=1, connect=fleet.connect)
+        applier = applyengine.FleetApplier(max_workers=1, max_failure_rate=0.1, pool=pool)
+
+        results = applier.apply("<config/>", hosts)
+
+        statuses = [result.status for result in results]
+        self.assertEqual(statuses[:3], [applyengine.FAILED] * 3)
+        self.assertEqual(statuses[3:], [applyengine.SKIPPED] * 17)
@@ -0,0 +1,198 @@
+import asyncio
+import unittest
+
+from lxml import etree
+
+from ote_utils.netconfutils import asyncnetconf
+from ote_utils.netconfutils.configurator import NETCONF_NS
+
+NC = "{%s}" % NETCONF_NS
+CONFIG = "<nc:config xmlns:nc='%s'>{}</nc:config>" % NETCONF_NS
+
+
+class StubNetconfServer(object):
+
+    """
+    Local NETCONF-over-TCP server answering edit-config, get-config, commit,
+    validation-type commits, discard-changes and close-session. Candidate
+    configs containing a reject element are refused with an rpc-error.
+
+    The framing is written out here rather than taken from the client, so
+    the client is checked against RFC 6242: end-of-message framing with
+    base:1.0 only, chunked framing once both sides announce base:1.1. Every
+    chunked reply is split into two chunks.
+    """
+
+    def __init__(self, capabilities=(asyncnetconf.BASE_1_0, asyncnetconf.BASE_1_1)):
+        self.capabilities = capabilities
+        self.running = etree.Element(NC + "data")
+        self.candidate = []
+        self.operations = []
+        self.session_ids = 0
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        self.session_ids += 1
+        hello = etree.Element(NC + "hello", nsmap={"nc": NETCONF_NS})
+        capabilities = etree.SubElement(hello, NC + "capabilities")
+        for capability in self.capabilities:
+            etree.SubElement(capabilities, NC + "capability").text = capability
+        etree.SubElement(hello, NC + "session-id").text = str(self.session_ids)
+        writer.write(etree.tostring(hello) + b"]]>]]>")
+        client_hello = etree.fromstring((await reader.readuntil(b"]]>]]>"))[:-6])
+        client_capabilities = [
+            capability.text for capability in client_hello.iter(NC + "capability")
+        ]
+        chunked = (
+            asyncnetconf.BASE_1_1 in self.capabilities
+            and asyncnetconf.BASE_1_1 in client_capabilities
+        )
+        try:
+            while True:
+                rpc = etree.fromstring(await self.read_message(reader, chunked))
+                operation = rpc[0]
+                self.operations.append(etree.QName(operation).localname)
+                reply = etree.Element(
+                    NC + "rpc-reply", {"message-id": rpc.get("message-id")}, nsmap={"nc": NETCONF_NS}
+                )
+                reply.extend(self.answer(operation))
+                self.write_message(writer, etree.tostring(reply), chunked)
+                await writer.drain()
+                if operation.tag == NC + "close-session":
+                    break
+        except asyncio.IncompleteReadError:
+            pass
+        writer.close()
+
+    async def read_message(self, reader, chunked):
+        if not chunked:
+            return (await reader.readuntil(b"]]>]]>"))[:-6]
+        chunks = []
+        while True:
+            assert await reader.readexactly(2) == b"\n#"
+            size = await reader.readuntil(b"\n")
+            if size == b"#\n":
+                return b"".join(chunks)
+            chunks.append(await reader.readexactly(int(size)))
+
+    def write_message(self, writer, message, chunked):
+        if not chunked:
+            writer.write(message + b"]]>]]>")
+            return
+        half = len(message) // 2
+        for chunk in (message[:half], message[half:]):
+            writer.write(b"\n#" + str(len(chunk)).encode("ascii") + b"\n" + chunk)
+        writer.write(b"\n##\n")
+
+    def answer(self, operation):
+        if operation.tag == NC + "edit-config":
+            config = operation.find(NC + "config")
+            if config is not None and config.find(".//reject") is not None:
+                error = etree.Element(NC + "rpc-error")
+                etree.SubElement(error, NC + "error-severity").text = "error"
+                return [error]
+            self.candidate.append(config)
+        elif operation.tag == NC + "get-config":
+            return [self.running]
+        elif operation.tag == NC + "commit":
+            self.running.extend(child for config in self.candidate for child in config)
+            self.candidate = []
+        elif operation.tag == NC + "discard-changes":
+            self.candidate = []
+        return [etree.Element(NC + "ok")]
+
+
+class AsyncNetconfTestCase(unittest.TestCase):
+    def run_with_server(self, test, **server_args):
+        async def run():
+            server = StubNetconfServer(**server_args)
+            port = await server.start()
+            try:
+                return await test(server, port)
+            finally:
+                await server.stop()
+
+        return asyncio.run(run())
+
+    def test_edit_and_commit(self):
+        async def test(server, port):
+            async with await asyncnetconf.connect_tcp("127.0.0.1", port) as session:
+                edit_status = await session.edit_config(
+                    target="candidate", config=CONFIG.format("<authority/>")
+                )
+                commit_status = await session.commit()
+                running = (await session.get_config(source="running")).data
+            return edit_status.ok, commit_status.ok, [child.tag for child in running]
+
+        for capabilities in ((asyncnetconf.BASE_1_0,), (asyncnetconf.BASE_1_0, asyncnetconf.BASE_1_1)):
+            self.assertEqual(
+                self.run_with_server(test, capabilities=capabilities),
+                (True, True, ["authority"]),
+            )
+
+    def test_rpc_error(self):
+        async def test(server, port):
+            async with await asyncnetconf.connect_tcp("127.0.0.1", port) as session:
+                return await session.edit_config(
+                    target="candidate", config=CONFIG.format("<reject/>")
+                )
+
+        reply = self.run_with_server(test)
+
+        self.assertFalse(reply.ok)
+        self.assertEqual(len(reply.errors), 1)
+
+    def test_session_closed(self):
+        async def test(server, port):
+            session = await asyncnetconf.connect_tcp("127.0.0.1", port)
+            await session.close_session()
+            self.assertFalse(session.connected)
+            with self.assertRaises(asyncnetconf.NetconfError):
+                await session.commit()
+
+        self.run_with_server(test)
+
+    def test_async_commit_config_xml(self):
+        async def test(server, port):
+            async def connect(host, port, username, key_filename):
+                return await asyncnetconf.connect_tcp(host, port)
+
+            results = await asyncio.gather(*[
+                asyncnetconf.async_commit_config_xml(
+                    CONFIG.format("<router/>"),
+                    t128_port=port,
+                    validationType="local",
+                    connect=connect,
+                )
+                for _ in range(100)
+            ])
+            return results, server.session_ids, server.operations
+
+        results, session_ids, operations = self.run_with_server(test)
+
+        self.assertEqual(results, [True] * 100)
+        self.assertEqual(session_ids, 100)
+        self.assertEqual(operations.count("commit"), 100)
+
+    def test_async_commit_config_xml_discards_rejected_changes(self):
+        async def test(server, port):
+            async def connect(host, port, username, key_filename):
+                return await asyncnetconf.connect_tcp(host, port)
+
+            result = await asyncnetconf.async_commit_config_xml(
+                CONFIG.format("<reject/>"), t128_port=port, connect=connect
+            )
+            return result, server.operations
+
+        result, operations = self.run_with_server(test)
+
+        self.assertFalse(result)
+        self.assertEqual(operations, ["edit-config", "discard-changes", "close-session"])
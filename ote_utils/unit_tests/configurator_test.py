@@ -0,0 +1,211 @@
+import os
+import threading
+import unittest
+
+from lxml import etree
+from ote_utils.netconfutils import benchmark
+from ote_utils.netconfutils import configurator
+from ote_utils.netconfutils import netconfconverter
+
+AUTHORITY_NS = "http://128technology.com/t128/config/authority-config"
+
+
+class StubReply(object):
+    def __init__(self, ok=True):
+        self.ok = ok
+
+
+class StubRPC(object):
+
+    "Stands in for an ncclient RPC sent in async mode"
+
+    def __init__(self, message_id):
+        self.id = message_id
+        self.event = threading.Event()
+        self.reply = None
+        self.error = None
+
+
+class PipelinedStubSession(object):
+
+    """
+    Stands in for an ncclient manager in async mode. Replies are held until
+    answer is called and are then delivered newest first, so results only
+    line up if they are matched by message-id.
+    """
+
+    def __init__(self, rejecting=()):
+        self.async_mode = False
+        self.rejecting = set(rejecting)
+        self.sent = []
+        self.outstanding = []
+        self.max_outstanding = 0
+
+    def edit_config(self, target, config, **kwargs):
+        return self.send("edit-config", config)
+
+    def validate(self, source):
+        return self.send("validate", source)
+
+    def commit(self):
+        return self.send("commit", None)
+
+    def dispatch(self, rpc_command):
+        return self.send("dispatch", rpc_command)
+
+    def send(self, operation, content):
+        assert self.async_mode
+        rpc = StubRPC(str(len(self.sent) + 1))
+        self.sent.append((operation, content))
+        self.outstanding.append((rpc, content not in self.rejecting))
+        self.max_outstanding = max(self.max_outstanding, len(self.outstanding))
+        threading.Timer(0.05, self.answer).start()
+        return rpc
+
+    def answer(self):
+        while self.outstanding:
+            rpc, ok = self.outstanding.pop()
+            rpc.reply = StubReply(ok)
+            rpc.event.set()
+
+
+class NetconfTransactionTestCase(unittest.TestCase):
+    def test_pipelined_transaction(self):
+        session = PipelinedStubSession()
+        transaction = configurator.ncclientAgent(session).transaction()
+        transaction.editConfig("candidate", "<authority/>")
+        transaction.editConfig("candidate", "<router/>")
+        transaction.validateConfig()
+        transaction.commitConfig(validationType="local")
+
+        results = transaction.execute(timeout=5)
+
+        self.assertEqual(
+            [(result.operation, result.message_id, result.ok) for result in results],
+            [
+                ("edit-config", "1", True),
+                ("edit-config", "2", True),
+                ("validate", "3", True),
+                ("commit", "4", True),
+            ],
+        )
+        self.assertEqual(session.max_outstanding, 3)
+        self.assertEqual(session.sent[3][0], "dispatch")
+        self.assertFalse(session.async_mode)
+
+    def test_commit_not_sent_after_failure(self):
+        session = PipelinedStubSession(rejecting=["<router/>"])
+        transaction = configurator.ncclientAgent(session).transaction()
+        transaction.editConfig("candidate", "<authority/>")
+        transaction.editConfig("candidate", "<router/>")
+        transaction.commitConfig()
+
+        results = transaction.execute(timeout=5)
+
+        self.assertEqual([result.ok for result in results], [True, False, False])
+        self.assertEqual(results[2].error, "Not sent: an earlier rpc failed")
+        self.assertEqual([operation for operation, _ in session.sent], ["edit-config"] * 2)
+
+    def test_timeout(self):
+        session = PipelinedStubSession()
+        session.answer = lambda: None
+        transaction = configurator.ncclientAgent(session).transaction()
+        transaction.editConfig("candidate", "<authority/>")
+
+        results = transaction.execute(timeout=0.05)
+
+        self.assertFalse(results[0].ok)
+        self.assertEqual(results[0].error, "Timed out waiting for the rpc-reply")
+
+
+class StubSession(object):
+    def __init__(self, rejecting=None):
+        self.rejecting = rejecting
+        self.edits = []
+        self.discarded = False
+
+    def edit_config(self, target, config):
+        self.edits.append(config)
+        return StubReply(self.rejecting is None or config.find(self.rejecting) is None)
+
+    def discard_changes(self):
+        self.discarded = True
+
+
+class ChunkedEditTestCase(unittest.TestCase):
+    def setUp(self):
+        super(ChunkedEditTestCase, self).setUp()
+        converter = netconfconverter.NetconfConverter()
+        converter.load_config_model(
+            os.path.join(os.path.dirname(__file__), "resources", "consolidatedT128Model.xml")
+        )
+        self.config_xml = converter.convert_config_to_netconf_xml(
+            benchmark.generate_config(5, 2), "config", pretty=False
+        )
+
+    def test_split_config(self):
+        chunks = list(configurator.split_config(self.config_xml, None))
+
+        self.assertEqual(
+            [label for label, _ in chunks], ["router router{}".format(number) for number in range(5)]
+        )
+        for number, (_, chunk) in enumerate(chunks):
+            authority = chunk[0][0]
+            self.assertEqual(authority.findtext("{%s}name" % AUTHORITY_NS), "Authority128")
+            self.assertEqual(
+                [router.findtext("{%s}name" % AUTHORITY_NS) for router in authority.iter("{%s}router" % AUTHORITY_NS)],
+                ["router{}".format(number)],
+            )
+        self.assertEqual(len(self.config_xml[0][0].findall("{%s}router" % AUTHORITY_NS)), 5)
+
+    def test_split_config_groups_entries(self):
+        router_size = len(etree.tostring(self.config_xml[0][0][1]))
+
+        chunks = list(configurator.split_config(etree.tostring(self.config_xml), router_size * 2))
+
+        self.assertEqual(
+            [label for label, _ in chunks],
+            ["router router0 (+1 more)", "router router2 (+1 more)", "router router4"],
+        )
+
+    def test_chunked_edit(self):
+        session = StubSession()
+        progress = []
+        t128_configurator = configurator.t128Configurator(configurator.ncclientAgent(session))
+
+        edit_status = t128_configurator.config(self.config_xml, "chunked", None, progress.append)
+
+        self.assertTrue(edit_status.ok)
+        self.assertEqual(len(session.edits), 5)
+        self.assertEqual([chunk.index for chunk in progress], [1, 2, 3, 4, 5])
+        self.assertEqual(edit_status.size, sum(len(etree.tostring(edit)) for edit in session.edits))
+
+    def test_chunked_edit_stops_on_rejected_chunk(self):
+        session = StubSession(rejecting=".//{%s}name[.='router1']" % AUTHORITY_NS)
+        agent = configurator.ncclientAgent(session)
+
+        edit_status = agent.editConfigChunked("candidate", self.config_xml, None, lambda chunk: None)
+
+        self.assertFalse(edit_status.ok)
+        self.assertEqual([chunk.ok for chunk in edit_status.chunks], [True, False])
+        self.assertTrue(session.discarded)
+
+    def test_split_config_created_entry(self):
+        router = self.config_xml[0][0][1]
+        router.set(configurator.OPERATION_ATTRIBUTE, "create")
+        del self.config_xml[0][0][2:]
+        del self.config_xml[0][0][0]
+
+        chunks = list(configurator.split_config(self.config_xml, None))
+
+        self.assertEqual([label for label, _ in chunks], ["router", "node node1"])
+        self.assertEqual(
+            [chunk[0][0][0].get(configurator.OPERATION_ATTRIBUTE) for _, chunk in chunks],
+            ["create", None],
+        )
+        self.assertEqual(chunks[1][1][0][0][0].findtext("{%s}name" % AUTHORITY_NS), "router0")
+
+        router.set(configurator.OPERATION_ATTRIBUTE, "replace")
+        chunks = list(configurator.split_config(self.config_xml, None))
+
+        self.assertEqual([label for label, _ in chunks], ["router router0"])
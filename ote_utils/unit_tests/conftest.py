@@ -0,0 +1,7 @@
+import sys
+
+collect_ignore = []
+if sys.version_info < (3, 7):
+    # asyncnetconf needs async/await and asyncio.run, which Python 2 cannot
+    # even parse, so the test module is left out instead of skipped.
+    collect_ignore.append("asyncnetconf_test.py")
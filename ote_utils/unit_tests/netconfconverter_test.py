@@ -1,11 +1,19 @@
+import io
+import multiprocessing
 import os
+import shutil
 import sys
+import tempfile
 import textwrap
+import time
 
 import pytest
 import xmlunittest
 
 from lxml import etree
+from ote_utils.netconfutils import benchmark
+from ote_utils.netconfutils import leafvalidation
+from ote_utils.netconfutils import modelregistry
 from ote_utils.netconfutils import netconfconverter
 
 
@@ -532,6 +540,989 @@ class NetconfConverterTestCase(xmlunittest.XmlTestCase):
 
         self.assertXmlEquivalentOutputs(given, expected)
 
+    def test_model_index_flattens_choice(self):
+        namespace, prefix, keyword = self.t128_model._find_model_node(
+            ["config", "authority", "router", "routing", "routing-protocol"], "local-as"
+        )
+
+        self.assertEqual(namespace, "http://128technology.com/t128/config/bgp-config")
+        self.assertEqual(prefix, "bgp")
+        self.assertEqual(keyword, "leaf")
+
+    def test_model_index_unknown_token(self):
+        with pytest.raises(Exception):
+            self.t128_model._find_model_node(["config", "authority"], "WRONG_ELEMENT")
+
+    def test_find_child(self):
+        node = self.t128_model.model.getroot()
+        for name in ["config", "authority", "router", "routing", "static-route"]:
+            node = self.t128_model.find_child(node, name)
+        blackhole = self.t128_model.find_child(node, "blackhole")
+
+        self.assertEqual(blackhole.get("name"), "blackhole")
+        self.assertIn(etree.QName(blackhole.getparent()).localname, ["choice", "case"])
+        self.assertIs(self.t128_model.find_child(node, "blackhole"), blackhole)
+        self.assertIsNone(self.t128_model.find_child(node, "WRONG_ELEMENT"))
+
+    def test_model_cache(self):
+        config = textwrap.dedent(
+            """
+            config
+                authority
+                    router combo1
+                        name combo1
+                        routing default-instance
+                            type default-instance
+                        exit
+                    exit
+                exit
+            exit"""
+        )
+        cache_dir = tempfile.mkdtemp()
+        try:
+            first = netconfconverter.NetconfConverter()
+            first.load_config_model(get_resource_path("consolidatedT128Model.xml"), cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            cached = netconfconverter.NetconfConverter()
+            cached.load_config_model(get_resource_path("consolidatedT128Model.xml"), cache_dir)
+            self.assertIsNone(cached._model)
+
+            given = etree.tostring(cached.convert_config_to_netconf_xml(config, tag="config"))
+            expected = etree.tostring(first.convert_config_to_netconf_xml(config, tag="config"))
+            self.assertEqual(given, expected)
+            self.assertIsNotNone(cached.model.getroot())
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_streaming_output(self):
+        config = textwrap.dedent(
+            """
+            config
+                authority
+                    name Authority128
+                    tenant Foo
+                        delete description force
+                    exit
+                    router combo1
+                        name combo1
+                        routing default-instance
+                            type default-instance
+                            routing-protocol bgp
+                                type bgp
+                                local-as 2
+                            exit
+                        exit
+                    exit
+                exit
+            exit"""
+        )
+
+        output = io.BytesIO()
+        result = self.t128_model.convert_config_to_netconf_xml(
+            config, tag="config", output=output
+        )
+        expected = etree.tostring(
+            self.t128_model.convert_config_to_netconf_xml(config, tag="config")
+        )
+
+        self.assertIsNone(result)
+        self.assertXmlEquivalentOutputs(output.getvalue(), expected)
+
+    def test_streaming_missing_exit(self):
+        config = textwrap.dedent(
+            """
+            config
+                authority
+                exit"""
+        )
+
+        with pytest.raises(netconfconverter.ConfigParseError):
+            self.t128_model.convert_config_to_netconf_xml(
+                config, tag="config", output=io.BytesIO()
+            )
+
+    def test_file_input(self):
+        config = textwrap.dedent(
+            """
+            config
+                authority
+
+                    # comment
+                    name Authority128
+                exit
+            exit
+            """
+        )
+
+        given = etree.tostring(
+            self.t128_model.convert_config_to_netconf_xml(io.StringIO(config), tag="config")
+        )
+        expected = etree.tostring(
+            self.t128_model.convert_config_to_netconf_xml(config, tag="config")
+        )
+
+        self.assertEqual(given, expected)
+
+    def test_generator_input(self):
+        config = ["config", "authority", "name Authority128", "exit", "exit"]
+
+        given = etree.tostring(
+            self.t128_model.convert_config_to_netconf_xml(
+                (line for line in config), tag="config"
+            )
+        )
+        expected = etree.tostring(
+            self.t128_model.convert_config_to_netconf_xml(config, tag="config")
+        )
+
+        self.assertEqual(given, expected)
+
+    def test_convert_many(self):
+        configs = [
+            ["config", "authority", "name first", "exit", "exit"],
+            ["config", "authority", "WRONG_ELEMENT", "exit", "exit"],
+            "config\n    authority\n        name third\n    exit\nexit",
+        ]
+
+        results = list(self.t128_model.convert_many(configs))
+
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0][0].findtext(".//{*}name"), "first")
+        self.assertIsNone(results[0][1])
+        self.assertIsNone(results[1][0])
+        self.assertIsInstance(results[1][1], netconfconverter.ConfigParseError)
+        self.assertEqual(results[2][0].findtext(".//{*}name"), "third")
+        self.assertIsNone(results[2][1])
+
+    def test_parallel_convert(self):
+        config = textwrap.dedent(
+            """
+            config
+                authority
+                    name Authority128
+                    router combo1
+                        name combo1
+                        routing default-instance
+                            type default-instance
+                        exit
+                    exit
+                    router combo2
+                        name combo2
+                    exit
+                    tenant Foo
+                        delete description force
+                    exit
+                exit
+            exit"""
+        )
+
+        given = etree.tostring(
+            self.t128_model.convert_config_to_netconf_xml_parallel(
+                config, tag="config", processes=2
+            )
+        )
+        expected = etree.tostring(
+            self.t128_model.convert_config_to_netconf_xml(config, tag="config")
+        )
+
+        self.assertEqual(given, expected)
+
+    @pytest.mark.skipif(
+        not hasattr(multiprocessing, "get_context"), reason="needs multiprocessing contexts"
+    )
+    def test_parallel_convert_spawn_with_warm_cache(self):
+        config = textwrap.dedent(
+            """
+            config
+                authority
+                    router combo1
+                        name combo1
+                        service-route west
+                            name west
+                            service-name west
+                            routing-stack
+                        exit
+                    exit
+                    router combo2
+                        name combo2
+                        service-route west
+                            name west
+                            service-name west
+                            routing-stack
+                        exit
+                    exit
+                exit
+            exit"""
+        )
+        profiler = netconfconverter.ConversionProfiler()
+        cached_model = t128_model()
+        cached_model.subtree_cache = netconfconverter.SubtreeCache()
+        cached_model.profiler = profiler
+        expected = etree.tostring(cached_model.convert_config_to_netconf_xml(config, tag="config"))
+        self.assertEqual(len(cached_model.subtree_cache), 1)
+
+        given = etree.tostring(
+            cached_model.convert_config_to_netconf_xml_parallel(
+                config, tag="config", processes=2, context=multiprocessing.get_context("spawn")
+            )
+        )
+
+        self.assertEqual(given, expected)
+        self.assertEqual(profiler.counters["conversions"], 2)
+        self.assertEqual(profiler.counters["parallel_chunks"], 2)
+        self.assertEqual(profiler.counters["lines"], 2 * 20)
+
+    def test_parallel_convert_error(self):
+        config = textwrap.dedent(
+            """
+            config
+                authority
+                    router combo1
+                        name combo1
+                    exit
+                    router combo2
+                        WRONG_ELEMENT
+                    exit
+                exit
+            exit"""
+        )
+
+        with pytest.raises(netconfconverter.ConfigParseError):
+            self.t128_model.convert_config_to_netconf_xml_parallel(
+                config, tag="config", processes=2
+            )
+
+    def test_identities_per_instance(self):
+        bgp_ns = "http://128technology.com/t128/config/bgp-config"
+        routing_ns = "http://128technology.com/t128/config/routing-config"
+
+        self.assertTrue(self.t128_model._is_identity_type("ipv4-unicast", bgp_ns))
+        self.assertFalse(self.t128_model._is_identity_type("ipv4-unicast", routing_ns))
+        self.assertTrue(self.t128_model._is_identity_type("bgp", routing_ns))
+        self.assertFalse(
+            netconfconverter.NetconfConverter()._is_identity_type("bgp", routing_ns)
+        )
+
+    def test_model_registry_lru(self):
+        model_file = get_resource_path("consolidatedT128Model.xml")
+        model_copy_dir = tempfile.mkdtemp()
+        try:
+            model_copy = os.path.join(model_copy_dir, "consolidatedT128Model.xml")
+            shutil.copy(model_file, model_copy)
+
+            registry = modelregistry.ModelRegistry(max_models=1)
+            registry.register("a", model_file)
+            first = registry.get_converter("a")
+            self.assertIs(registry.get_converter(model_file), first)
+            registry.get_converter(model_copy)
+            self.assertIsNot(registry.get_converter("a"), first)
+
+            self.assertEqual(
+                registry.stats(),
+                {"hits": 1, "misses": 3, "evictions": 2, "loaded": [model_file]},
+            )
+        finally:
+            shutil.rmtree(model_copy_dir)
+
+    def test_tokenize_config_line(self):
+        tokenize = netconfconverter.tokenize_config_line
+
+        self.assertEqual(tokenize("exit"), (None, "exit", None))
+        self.assertEqual(tokenize("name  combo1 "), (None, "name", "combo1"))
+        self.assertEqual(
+            tokenize("description service   for everyone"),
+            (None, "description", "service for everyone"),
+        )
+        self.assertEqual(
+            tokenize("delete address force 1.1.1.1/16"),
+            ("delete", "address", "force 1.1.1.1/16"),
+        )
+        self.assertEqual(
+            tokenize('description "two  spaces \\\\ and \\"quotes\\""'),
+            (None, "description", 'two  spaces \\ and "quotes"'),
+        )
+        self.assertEqual(
+            tokenize('create description "a b"'), ("create", "description", "a b")
+        )
+        self.assertEqual(tokenize("delete"), (None, "delete", None))
+        self.assertEqual(
+            tokenize('description "regex ^\\d+$"'), (None, "description", "regex ^\\d+$")
+        )
+        self.assertEqual(
+            tokenize('description "C:\\path with space"'),
+            (None, "description", "C:\\path with space"),
+        )
+
+    def test_quoted_value_convert(self):
+        config = [
+            "config",
+            "authority",
+            "service inet",
+            "name inet",
+            'description "service  for \\"everyone\\""',
+            "exit",
+            "exit",
+            "exit",
+        ]
+
+        root = self.t128_model.convert_config_to_netconf_xml(config, tag="config")
+
+        self.assertEqual(root.findtext(".//{*}description"), 'service  for "everyone"')
+
+    def test_xml_to_config_round_trip(self):
+        config = textwrap.dedent(
+            """
+            config
+                authority
+                    name Authority128
+                    router combo1
+                        name combo1
+                        routing default-instance
+                            type default-instance
+                            static-route 66.151.176.0/24 1
+                                destination-prefix 66.151.176.0/24
+                                distance 1
+                                next-hop 1.1.1.1
+                            exit
+                        exit
+                    exit
+                    service inet
+                        name inet
+                        description "service  for \\"everyone\\""
+                    exit
+                    tenant Foo
+                        name Foo
+                        delete description force
+                    exit
+                exit
+            exit"""
+        ).strip()
+
+        config_xml = self.t128_model.convert_config_to_netconf_xml(config, tag="config")
+        given = self.t128_model.convert_netconf_xml_to_config(
+            io.BytesIO(etree.tostring(config_xml))
+        )
+
+        self.assertEqual(given, config)
+        self.assertEqual(
+            etree.tostring(self.t128_model.convert_config_to_netconf_xml(given, tag="config")),
+            etree.tostring(config_xml),
+        )
+
+    def test_xml_to_config_rpc_reply(self):
+        reply = textwrap.dedent(
+            """
+            <rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="1">
+                <data>
+                    <t128:config xmlns:t128="http://128technology.com/t128">
+                        <authy:authority xmlns:authy="http://128technology.com/t128/config/authority-config">
+                            <authy:router>
+                                <authy:name>combo1</authy:name>
+                                <rt:routing xmlns:rt="http://128technology.com/t128/config/routing-config">
+                                    <rt:type>rt:default-instance</rt:type>
+                                </rt:routing>
+                            </authy:router>
+                        </authy:authority>
+                    </t128:config>
+                </data>
+            </rpc-reply>"""
+        ).strip()
+
+        output = io.StringIO()
+        self.t128_model.convert_netconf_xml_to_config(
+            etree.fromstring(reply), output=output
+        )
+
+        expected = textwrap.dedent(
+            """
+            config
+                authority
+                    router combo1
+                        name combo1
+                        routing default-instance
+                            type default-instance
+                        exit
+                    exit
+                exit
+            exit"""
+        ).strip()
+
+        self.assertEqual(output.getvalue(), expected)
+
+    def test_diff_netconf_xml(self):
+        current = textwrap.dedent(
+            """
+            config
+                authority
+                    name Authority128
+                    router combo1
+                        name combo1
+                        description old
+                    exit
+                    router combo2
+                        name combo2
+                    exit
+                    tenant Foo
+                        name Foo
+                    exit
+                exit
+            exit"""
+        )
+        desired = textwrap.dedent(
+            """
+            config
+                authority
+                    name Authority128
+                    router combo1
+                        name combo1
+                        description new
+                    exit
+                    router combo3
+                        name combo3
+                    exit
+                    tenant Foo
+                        name Foo
+                    exit
+                exit
+            exit"""
+        )
+
+        given = etree.tostring(
+            self.t128_model.diff_netconf_xml(
+                self.t128_model.convert_config_to_netconf_xml(current, tag="config"),
+                self.t128_model.convert_config_to_netconf_xml(desired, tag="config"),
+            )
+        )
+
+        expected = textwrap.dedent(
+            """
+            <ns0:config xmlns:ns0="urn:ietf:params:xml:ns:netconf:base:1.0">
+                <t128:config xmlns:t128="http://128technology.com/t128">
+                    <authy:authority xmlns:authy="http://128technology.com/t128/config/authority-config">
+                        <authy:router>
+                            <authy:name>combo1</authy:name>
+                            <authy:description>new</authy:description>
+                        </authy:router>
+                        <authy:router ns0:operation="create">
+                            <authy:name>combo3</authy:name>
+                        </authy:router>
+                        <authy:router ns0:operation="delete">
+                            <authy:name>combo2</authy:name>
+                        </authy:router>
+                    </authy:authority>
+                </t128:config>
+            </ns0:config>"""
+        )
+
+        self.assertXmlEquivalentOutputs(given, expected)
+
+    def test_diff_netconf_xml_with_deletes(self):
+        current = textwrap.dedent(
+            """
+            config
+                authority
+                    name Authority128
+                    router combo1
+                        name combo1
+                        description old
+                    exit
+                    tenant Foo
+                        name Foo
+                    exit
+                exit
+            exit"""
+        )
+        desired = textwrap.dedent(
+            """
+            config
+                authority
+                    name Authority128
+                    router combo1
+                        name combo1
+                        delete description force
+                    exit
+                    delete tenant Foo force
+                        name Foo
+                    exit
+                    delete tenant Bar force
+                        name Bar
+                    exit
+                    router combo2
+                        name combo2
+                        delete description force
+                    exit
+                exit
+            exit"""
+        )
+
+        given = etree.tostring(
+            self.t128_model.diff_netconf_xml(
+                self.t128_model.convert_config_to_netconf_xml(current, tag="config"),
+                self.t128_model.convert_config_to_netconf_xml(desired, tag="config"),
+            )
+        )
+
+        expected = textwrap.dedent(
+            """
+            <ns0:config xmlns:ns0="urn:ietf:params:xml:ns:netconf:base:1.0">
+                <t128:config xmlns:t128="http://128technology.com/t128">
+                    <authy:authority xmlns:authy="http://128technology.com/t128/config/authority-config">
+                        <authy:router>
+                            <authy:name>combo1</authy:name>
+                            <authy:description ns0:operation="delete">force</authy:description>
+                        </authy:router>
+                        <authy:tenant ns0:operation="delete">
+                            <authy:name>Foo</authy:name>
+                        </authy:tenant>
+                        <authy:router ns0:operation="create">
+                            <authy:name>combo2</authy:name>
+                        </authy:router>
+                    </authy:authority>
+                </t128:config>
+            </ns0:config>"""
+        )
+
+        self.assertXmlEquivalentOutputs(given, expected)
+
+    def test_diff_netconf_xml_partial(self):
+        current = textwrap.dedent(
+            """
+            config
+                authority
+                    name Authority128
+                    router combo1
+                        name combo1
+                        description old
+                        node node1
+                            name node1
+                        exit
+                    exit
+                    router combo2
+                        name combo2
+                    exit
+                    tenant Foo
+                        name Foo
+                    exit
+                exit
+            exit"""
+        )
+        desired = textwrap.dedent(
+            """
+            config
+                authority
+                    router combo1
+                        name combo1
+                    exit
+                exit
+            exit"""
+        )
+
+        given = etree.tostring(
+            self.t128_model.diff_netconf_xml(
+                self.t128_model.convert_config_to_netconf_xml(current, tag="config"),
+                self.t128_model.convert_config_to_netconf_xml(desired, tag="config"),
+                partial=True,
+            )
+        )
+
+        expected = textwrap.dedent(
+            """
+            <ns0:config xmlns:ns0="urn:ietf:params:xml:ns:netconf:base:1.0">
+                <t128:config xmlns:t128="http://128technology.com/t128">
+                    <authy:authority xmlns:authy="http://128technology.com/t128/config/authority-config">
+                        <authy:router>
+                            <authy:name>combo1</authy:name>
+                            <authy:description ns0:operation="delete"/>
+                            <sys:node xmlns:sys="http://128technology.com/t128/config/system-config" ns0:operation="delete">
+                                <sys:name>node1</sys:name>
+                            </sys:node>
+                        </authy:router>
+                    </authy:authority>
+                </t128:config>
+            </ns0:config>"""
+        )
+
+        self.assertXmlEquivalentOutputs(given, expected)
+
+    def test_diff_netconf_xml_unknown_element(self):
+        config = "config\n    authority\n        name Authority128\n    exit\nexit"
+        current = self.t128_model.convert_config_to_netconf_xml(config, tag="config")
+        authority = next(current.iter("{*}authority"))
+        etree.SubElement(authority, etree.QName(authority, "new-feature")).text = "on"
+
+        with pytest.raises(netconfconverter.ConfigParseError) as error:
+            self.t128_model.diff_netconf_xml(
+                current, self.t128_model.convert_config_to_netconf_xml(config, tag="config")
+            )
+
+        self.assertEqual(error.value.path, "config/authority/new-feature")
+        self.assertEqual(error.value.token, "new-feature")
+
+    def test_diff_netconf_xml_unchanged(self):
+        config = "config\n    authority\n        name Authority128\n    exit\nexit"
+
+        self.assertIsNone(
+            self.t128_model.diff_netconf_xml(
+                self.t128_model.convert_config_to_netconf_xml(config, tag="config"),
+                self.t128_model.convert_config_to_netconf_xml(config, tag="config"),
+            )
+        )
+
+    def test_subtree_cache(self):
+        config = textwrap.dedent(
+            """
+            config
+                authority
+                    router combo1
+                        name combo1
+                        service-route west
+                            name west
+                            service-name west
+                            routing-stack
+                        exit
+                    exit
+                    router combo2
+                        name combo2
+                        service-route west
+                            name west
+                            service-name west
+                            routing-stack
+                        exit
+                    exit
+                    router combo3
+                        name combo3
+                        service-route west
+                            name west
+                            service-name west
+                            routing-stack
+                        exit
+                    exit
+                exit
+            exit"""
+        )
+        cached_model = t128_model()
+        cached_model.subtree_cache = netconfconverter.SubtreeCache()
+
+        expected = etree.tostring(
+            self.t128_model.convert_config_to_netconf_xml(config, tag="config")
+        )
+        given = etree.tostring(cached_model.convert_config_to_netconf_xml(config, tag="config"))
+        self.assertEqual(given, expected)
+        # The first service-route is remembered, the second recorded and the
+        # third replayed; the routers and their wrappers are never recorded.
+        self.assertEqual(cached_model.subtree_cache.hits, 1)
+        self.assertEqual(len(cached_model.subtree_cache), 1)
+
+        given = etree.tostring(cached_model.convert_config_to_netconf_xml(config, tag="config"))
+        self.assertEqual(given, expected)
+        self.assertEqual(cached_model.subtree_cache.hits, 4)
+
+    def test_subtree_cache_bounds(self):
+        cache = netconfconverter.SubtreeCache(max_events=10)
+        cache.put("a", ("event",) * 4)
+        cache.put("b", ("event",) * 4)
+        cache.put("c", ("event",) * 4)
+        cache.put("d", ("event",) * 11)
+
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNone(cache.get("d"))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.events, 8)
+        self.assertFalse(cache.should_record("e"))
+        self.assertTrue(cache.should_record("e"))
+
+    def test_compact_convert(self):
+        config = textwrap.dedent(
+            """
+            config
+                authority
+                    name Authority128
+                    router combo1
+                        name combo1
+                        routing default-instance
+                            type default-instance
+                        exit
+                    exit
+                exit
+            exit"""
+        )
+
+        compact = self.t128_model.convert_config_to_netconf_xml(
+            config, tag="config", pretty=False
+        )
+        pretty = self.t128_model.convert_config_to_netconf_xml(config, tag="config")
+
+        for elem in compact.iter():
+            self.assertIsNone(elem.tail)
+            if len(elem):
+                self.assertIsNone(elem.text)
+        self.assertXmlEquivalentOutputs(etree.tostring(compact), etree.tostring(pretty))
+        self.assertLess(len(etree.tostring(compact)), len(etree.tostring(pretty)))
+
+    def test_benchmark_config_converts(self):
+        config = benchmark.generate_config(2, 3)
+
+        result = self.t128_model.convert_config_to_netconf_xml(config, tag="config")
+
+        routers = result.findall(".//{http://128technology.com/t128/config/authority-config}router")
+        self.assertEqual(len(routers), 2)
+        for router in routers:
+            self.assertEqual(len(router.findall(".//{*}device-interface")), 3)
+
+    def test_benchmark_config_depth(self):
+        self.assertEqual(benchmark.generate_config(2, 3), benchmark.generate_config(2, 3, 5))
+        levels = ["router", "node", "device-interface", "network-interface", "address"]
+        for depth in range(1, benchmark.MAX_DEPTH + 1):
+            config = benchmark.generate_config(2, 3, depth)
+
+            result = self.t128_model.convert_config_to_netconf_xml(config, tag="config")
+
+            counts = [len(result.findall(".//{*}" + level)) for level in levels]
+            self.assertEqual(counts, [2, 2, 6, 6, 6][:depth] + [0] * (benchmark.MAX_DEPTH - depth))
+        with pytest.raises(ValueError):
+            benchmark.generate_config(1, 1, 0)
+
+    def test_conversion_profiler(self):
+        config = benchmark.generate_config(1, 2)
+        profiler = netconfconverter.ConversionProfiler()
+        profiled_model = netconfconverter.NetconfConverter(profiler=profiler)
+        profiled_model.load_config_model(get_resource_path("consolidatedT128Model.xml"))
+
+        expected = etree.tostring(
+            self.t128_model.convert_config_to_netconf_xml(config, tag="config")
+        )
+        given = etree.tostring(profiled_model.convert_config_to_netconf_xml(config, tag="config"))
+        self.assertEqual(given, expected)
+
+        stats = profiler.stats()
+        for phase in ("model_load", "model_index", "tokenize", "lookup", "build", "convert"):
+            self.assertIn(phase, stats["timers"])
+        self.assertEqual(stats["counters"]["conversions"], 1)
+        self.assertEqual(stats["counters"]["lines"], len(config))
+        exits = [line.strip() for line in config].count("exit")
+        self.assertEqual(stats["counters"]["lookups"], len(config) - exits)
+
+        profiler.reset()
+        self.assertEqual(profiler.stats()["counters"], {})
+
+    def test_leaf_validation(self):
+        config = benchmark.generate_config(1, 1)
+        vlan_index = [line.strip() for line in config].index("vlan 0")
+        validating_model = t128_model()
+        validating_model.validator = leafvalidation.LeafValidator()
+
+        given = etree.tostring(validating_model.convert_config_to_netconf_xml(config, tag="config"))
+        expected = etree.tostring(
+            self.t128_model.convert_config_to_netconf_xml(config, tag="config")
+        )
+        self.assertEqual(given, expected)
+
+        for invalid_line in ("vlan 5000", "vlan x", "type bogus", "name bad!name"):
+            invalid_config = list(config)
+            invalid_config[vlan_index] = invalid_line
+            with pytest.raises(netconfconverter.ConfigParseError) as error:
+                validating_model.convert_config_to_netconf_xml(invalid_config, tag="config")
+            self.assertIn("Invalid value", str(error.value))
+
+    def test_copy_keeps_settings_separate(self):
+        config = benchmark.generate_config(1, 1)
+        config[[line.strip() for line in config].index("vlan 0")] = "vlan 5000"
+        validating_model = self.t128_model.copy(
+            profiler=netconfconverter.ConversionProfiler(),
+            validator=leafvalidation.LeafValidator(),
+        )
+
+        with pytest.raises(netconfconverter.ConfigParseError):
+            validating_model.convert_config_to_netconf_xml(config, tag="config")
+        self.t128_model.convert_config_to_netconf_xml(config, tag="config")
+
+        self.assertIsNone(self.t128_model.validator)
+        self.assertIsNone(self.t128_model.profiler)
+        self.assertEqual(validating_model.profiler.stats()["counters"]["failed_conversions"], 1)
+
+    def test_leaf_validation_backtracking_pattern(self):
+        config = textwrap.dedent(
+            """
+            config
+                authority
+                    dynamic-hostname {}!
+                exit
+            exit"""
+        ).format("a" * 40)
+        validating_model = t128_model()
+        validating_model.validator = leafvalidation.LeafValidator()
+
+        start = time.time()
+        validating_model.convert_config_to_netconf_xml(config, tag="config")
+        self.assertLess(time.time() - start, 1)
+
+    def test_leafref_validation(self):
+        config = benchmark.generate_config(1, 1)
+        vlan_index = [line.strip() for line in config].index("vlan 0")
+        config[vlan_index] = "tenant blue"
+        validating_model = t128_model()
+        validating_model.validator = leafvalidation.LeafValidator(check_leafrefs=True)
+
+        with pytest.raises(netconfconverter.ConfigParseError) as error:
+            validating_model.convert_config_to_netconf_xml(config, tag="config")
+        self.assertIn("Leaf tenant", str(error.value))
+
+        config[3:3] = ["tenant blue", "name blue", "exit"]
+        validating_model.convert_config_to_netconf_xml(config, tag="config")
+
+    def test_leafref_validation_collect_errors(self):
+        config = benchmark.generate_config(2, 1)
+        vlan_indexes = [i for i, line in enumerate(config) if line.strip() == "vlan 0"]
+        for vlan_index, tenant in zip(vlan_indexes, ["blue", "red"]):
+            config[vlan_index] = config[vlan_index].replace("vlan 0", "tenant " + tenant)
+        validating_model = t128_model()
+        validating_model.validator = leafvalidation.LeafValidator(check_leafrefs=True)
+
+        with pytest.raises(netconfconverter.ConfigParseError) as error:
+            validating_model.convert_config_to_netconf_xml(
+                config, tag="config", collect_errors=True
+            )
+
+        self.assertEqual(
+            [(e.line_number, e.token) for e in error.value.errors],
+            [(vlan_indexes[0] + 1, "blue"), (vlan_indexes[1] + 1, "red")],
+        )
+        first_error = error.value.errors[0]
+        self.assertEqual(first_error.column, config[vlan_indexes[0]].index("blue") + 1)
+        self.assertTrue(first_error.path.endswith("network-interface"))
+
+        with pytest.raises(netconfconverter.ConfigParseError) as error:
+            validating_model.convert_config_to_netconf_xml(config, tag="config")
+        self.assertEqual(error.value.line_number, vlan_indexes[0] + 1)
+
+    def test_error_location(self):
+        config = textwrap.dedent(
+            """
+            config
+                authority
+                    service west
+                        WRONG_ELEMENT
+                    exit
+                exit
+            exit"""
+        )
+
+        with pytest.raises(netconfconverter.ConfigParseError) as error:
+            self.t128_model.convert_config_to_netconf_xml(config, tag="config")
+
+        self.assertEqual(error.value.line_number, 5)
+        self.assertEqual(error.value.column, 13)
+        self.assertEqual(error.value.path, "config/authority/service")
+        self.assertEqual(error.value.token, "WRONG_ELEMENT")
+        self.assertIn("line 5", str(error.value))
+
+    def test_collect_errors(self):
+        config = textwrap.dedent(
+            """
+            config
+                authority
+                    WRONG_LEAF x
+                    WRONG_BLOCK
+                        name x
+                    exit
+                    service west
+                        name west
+                        WRONG_ELEMENT
+                    exit
+                    exit
+                exit
+            exit"""
+        )
+
+        with pytest.raises(netconfconverter.ConfigParseError) as error:
+            self.t128_model.convert_config_to_netconf_xml(
+                config, tag="config", collect_errors=True
+            )
+
+        self.assertEqual(
+            [(e.line_number, e.token) for e in error.value.errors],
+            [(4, "WRONG_LEAF"), (5, "WRONG_BLOCK"), (10, "WRONG_ELEMENT"), (14, "exit")],
+        )
+
+    def test_collect_errors_unindented(self):
+        config = [
+            "config",
+            "authority",
+            "WRONG_BLOCK",
+            "name x",
+            "exit",
+            "service west",
+            "name west",
+            "exit",
+            "exit",
+            "exit",
+        ]
+
+        with pytest.raises(netconfconverter.ConfigParseError) as error:
+            self.t128_model.convert_config_to_netconf_xml(
+                config, tag="config", collect_errors=True
+            )
+
+        self.assertEqual(
+            [(e.line_number, e.token) for e in error.value.errors], [(3, "WRONG_BLOCK")]
+        )
+
+    def test_collect_errors_unindented_leaf(self):
+        config = [line.strip() for line in benchmark.generate_config(2, 1)]
+        vlan_indexes = [i for i, line in enumerate(config) if line == "vlan 0"]
+        for vlan_index in vlan_indexes:
+            config[vlan_index] = "vlan 5000"
+        validating_model = t128_model()
+        validating_model.validator = leafvalidation.LeafValidator()
+
+        with pytest.raises(netconfconverter.ConfigParseError) as error:
+            validating_model.convert_config_to_netconf_xml(
+                config, tag="config", collect_errors=True
+            )
+
+        self.assertEqual(
+            [(e.line_number, e.token) for e in error.value.errors],
+            [(vlan_index + 1, "5000") for vlan_index in vlan_indexes],
+        )
+
+    def test_compiled_schema(self):
+        self.assertIsNone(self.t128_model._model)
+
+        config_id = self.t128_model._find_child_node(netconfconverter.ROOT_NODE_ID, "config")
+        authority_id = self.t128_model._find_child_node(config_id, "authority")
+        router_id = self.t128_model._find_child_node(authority_id, "router")
+        router = self.t128_model._schema_nodes[router_id]
+        self.assertEqual(router.keyword, "list")
+        self.assertEqual(router.keys, ("name",))
+        with pytest.raises(AttributeError):
+            router.description = "not compiled"
+
+        name_id = self.t128_model._find_child_node(router_id, "name")
+        name = self.t128_model._schema_nodes[name_id]
+        self.assertEqual(name.keyword, "leaf")
+        with pytest.raises(leafvalidation.LeafValueError):
+            name.type.validate("bad!name")
+
+    def test_compiled_schema_from_model_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            for _ in range(2):
+                cached_model = netconfconverter.NetconfConverter(
+                    validator=leafvalidation.LeafValidator()
+                )
+                cached_model.load_config_model(
+                    get_resource_path("consolidatedT128Model.xml"), cache_dir
+                )
+            config = benchmark.generate_config(1, 1)
+            config[[line.strip() for line in config].index("vlan 0")] = "vlan 5000"
+
+            with pytest.raises(netconfconverter.ConfigParseError):
+                cached_model.convert_config_to_netconf_xml(config, tag="config")
+            self.assertIsNone(cached_model._model)
+        finally:
+            shutil.rmtree(cache_dir)
+
 
 def get_resource_path(resource_filename):
     return os.path.join(os.path.dirname(__file__), "resources", resource_filename)
@@ -0,0 +1,178 @@
+import threading
+import time
+import unittest
+
+from ote_utils.netconfutils import configurator
+from ote_utils.netconfutils import sessionpool
+
+
+class StubSession(object):
+
+    "Stands in for an ncclient manager connected to a NETCONF server"
+
+    def __init__(self, on_close=None, **connect_args):
+        self.connect_args = connect_args
+        self.connected = True
+        self.rpcs = []
+        self.on_close = on_close
+
+    def edit_config(self, **kwargs):
+        self.rpcs.append("edit-config")
+        return StubReply()
+
+    def commit(self):
+        self.rpcs.append("commit")
+        return StubReply()
+
+    def dispatch(self, rpc):
+        self.rpcs.append(rpc)
+        return StubReply()
+
+    def close_session(self):
+        self.rpcs.append("close-session")
+        self.connected = False
+        if self.on_close is not None:
+            self.on_close()
+
+
+class StubReply(object):
+    ok = True
+
+
+class NetconfSessionPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        super(NetconfSessionPoolTestCase, self).setUp()
+        self.sessions = []
+        self.on_close = None
+        self.pool = sessionpool.NetconfSessionPool(max_size=2, connect=self.connect)
+
+    def connect(self, **connect_args):
+        session = StubSession(self.on_close, **connect_args)
+        self.sessions.append(session)
+        return session
+
+    def test_session_reused_for_same_key(self):
+        with self.pool.session("10.0.0.1", "830", "admin", "key") as first:
+            pass
+        with self.pool.session("10.0.0.1", 830, "admin", "key") as second:
+            pass
+
+        self.assertIs(first, second)
+        self.assertEqual(first.connect_args["port"], 830)
+        self.assertFalse(first.connect_args["hostkey_verify"])
+        self.assertEqual(self.pool.stats()["created"], 1)
+        self.assertEqual(self.pool.stats()["reused"], 1)
+
+    def test_session_not_shared_between_keys(self):
+        first = self.pool.acquire("10.0.0.1", username="admin")
+        self.pool.release(first)
+        second = self.pool.acquire("10.0.0.1", username="root")
+
+        self.assertIsNot(first, second)
+
+    def test_disconnected_session_replaced(self):
+        with self.pool.session("10.0.0.1") as first:
+            pass
+        first.connected = False
+        with self.pool.session("10.0.0.1") as second:
+            pass
+
+        self.assertIsNot(first, second)
+        self.assertEqual(self.pool.stats()["discarded"], 1)
+
+    def test_session_discarded_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with self.pool.session("10.0.0.1") as first:
+                raise RuntimeError("edit failed")
+
+        self.assertEqual(first.rpcs, ["close-session"])
+        self.assertEqual(self.pool.stats()["idle"], 0)
+
+    def test_idle_timeout(self):
+        self.pool.idle_timeout = 0
+        with self.pool.session("10.0.0.1") as first:
+            pass
+        time.sleep(0.01)
+        with self.pool.session("10.0.0.1") as second:
+            pass
+
+        self.assertIsNot(first, second)
+        self.assertFalse(first.connected)
+
+    def test_max_size_evicts_idle_session(self):
+        with self.pool.session("10.0.0.1"):
+            pass
+        with self.pool.session("10.0.0.2"):
+            pass
+        with self.pool.session("10.0.0.3"):
+            pass
+
+        self.assertFalse(self.sessions[0].connected)
+        self.assertEqual(self.pool.stats()["idle"], 2)
+
+    def test_max_size_waits_for_release(self):
+        first = self.pool.acquire("10.0.0.1")
+        self.pool.acquire("10.0.0.2")
+        with self.assertRaises(sessionpool.SessionPoolError):
+            self.pool.acquire("10.0.0.3", timeout=0.01)
+
+        threading.Timer(0.05, self.pool.release, (first,)).start()
+        third = self.pool.acquire("10.0.0.3", timeout=5)
+
+        self.assertEqual(third.connect_args["host"], "10.0.0.3")
+        self.assertFalse(first.connected)
+
+    def test_commit_keeps_session_open(self):
+        with self.pool.session("10.0.0.1") as netconf_session:
+            t128_configurator = configurator.t128Configurator(
+                configurator.ncclientAgent(netconf_session)
+            )
+            t128_configurator.config("<config/>", "edit")
+            t128_configurator.commit()
+            t128_configurator.commit(validationType="local")
+
+        self.assertTrue(netconf_session.connected)
+        self.assertEqual(netconf_session.rpcs[:2], ["edit-config", "commit"])
+        self.assertEqual(
+            netconf_session.rpcs[2].find("{%s}validation-type" % configurator.VALIDATE_TYPE_NS).text,
+            "local",
+        )
+        self.assertEqual(self.pool.stats()["idle"], 1)
+
+    def test_close_all_with_sessions_in_use(self):
+        first = self.pool.acquire("10.0.0.1")
+        with self.pool.session("10.0.0.2"):
+            pass
+        self.pool.close_all()
+
+        self.assertFalse(self.sessions[1].connected)
+        self.assertTrue(first.connected)
+        self.pool.release(first)
+
+        self.assertFalse(first.connected)
+        self.assertEqual(self.pool.stats()["idle"], 0)
+        self.assertEqual(self.pool.stats()["in_use"], 0)
+
+    def test_sessions_closed_outside_lock(self):
+        stats = []
+
+        def on_close():
+            # Another thread must be able to use the pool during the close.
+            thread = threading.Thread(target=lambda: stats.append(self.pool.stats()))
+            thread.start()
+            thread.join(1)
+
+        self.on_close = on_close
+        with self.pool.session("10.0.0.1"):
+            pass
+        with self.pool.session("10.0.0.2"):
+            pass
+        with self.pool.session("10.0.0.3"):
+            pass
+        with self.assertRaises(RuntimeError):
+            with self.pool.session("10.0.0.3"):
+                raise RuntimeError("edit failed")
+        self.pool.close_all()
+
+        self.assertEqual(len(stats), 3)
+        self.assertFalse(any(session.connected for session in self.sessions))
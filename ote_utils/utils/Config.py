@@ -1,4 +1,6 @@
+from ote_utils.netconfutils import leafvalidation
 from ote_utils.netconfutils import netconfconverter
+from ote_utils.netconfutils.modelregistry import ModelRegistry
 from ote_utils.ote_logger import OteLogger
 
 logger = OteLogger(__name__)
@@ -10,21 +12,148 @@ class Config(object):
         expose to robot framework tests.
     """
 
+    MODEL_REGISTRY = ModelRegistry()
+
     def __init__(self):
         self.ncconv = netconfconverter.NetconfConverter()
+        self.profiler = None
+        self.validator = None
 
-    def load_t128_config_model(self, model_file):
+    def load_t128_config_model(self, model_file, cache_dir=None):
         """
             Loads the configuration model from the fully consolidated XML file.
 
             == Args ==
             - model_file (str) - the name of the xml file containing the config model
+            - cache_dir (str) - (Default: None) directory used to cache the compiled model
 
             == Example ==
             Load T128 Config Model    ${model_file}
+            Load T128 Config Model    ${model_file}    cache_dir=${cache_dir}
         """
         logger.debug('model_file: {}'.format(model_file))
-        return self.ncconv.load_config_model(model_file)
+        return self.ncconv.load_config_model(model_file, cache_dir)
+
+    def register_t128_config_model(self, version, model_file):
+        """
+            Registers a configuration model file under a version name in the
+            model registry shared by all Config instances.
+
+            == Args ==
+            - version (str) - the version name, for example 4.1.0
+            - model_file (str) - the name of the xml file containing the config model
+
+            == Example ==
+            Register T128 Config Model    4.1.0    ${model_file}
+        """
+        Config.MODEL_REGISTRY.register(version, model_file)
+
+    def use_t128_config_model(self, version_or_path):
+        """
+            Switches to a configuration model from the shared model registry,
+            loading it only if it is not already held in memory. The registry
+            keeps the most recently used models and evicts the others.
+            Validation and profiling settings stay with this instance.
+
+            == Args ==
+            - version_or_path (str) - a registered version or the name of a config model xml file
+
+            == Example ==
+            Use T128 Config Model    4.1.0
+        """
+        logger.debug('version_or_path: {}'.format(version_or_path))
+        # The registry's converter is shared by every Config instance, so
+        # conversions use a copy carrying this instance's settings.
+        self.ncconv = Config.MODEL_REGISTRY.get_converter(version_or_path).copy(
+            profiler=self.profiler, validator=self.validator
+        )
+
+    def get_t128_config_model_registry_stats(self):
+        """
+            Returns the shared model registry hit, miss and eviction counters
+            and the currently loaded model files.
+
+            == Example ==
+            ${stats}=    Get T128 Config Model Registry Stats
+        """
+        return Config.MODEL_REGISTRY.stats()
+
+    def enable_t128_config_validation(self, check_leafrefs=False):
+        """
+            Validates leaf values against their types in the loaded config
+            model (enumerations, ranges, lengths and patterns) while
+            converting, so invalid values fail locally with a
+            ``ConfigParseError`` instead of being rejected by the router.
+
+            == Args ==
+            - check_leafrefs (bool) - (Default: False) also require each leafref value to be defined
+              elsewhere in the same config; only use with complete configs
+
+            == Example ==
+            Enable T128 Config Validation
+            Enable T128 Config Validation    check_leafrefs=${True}
+        """
+        self.validator = leafvalidation.LeafValidator(check_leafrefs)
+        self.ncconv.validator = self.validator
+
+    def disable_t128_config_validation(self):
+        """
+            Stops validating leaf values while converting.
+
+            == Example ==
+            Disable T128 Config Validation
+        """
+        self.validator = None
+        self.ncconv.validator = None
+
+    def enable_t128_conversion_profiling(self, log_stats=False):
+        """
+            Starts collecting per-phase timers and counters for model loads and
+            conversions: model parse and index times, model cache hits,
+            tokenize, lookup and build times and lines processed. Profiling is
+            off by default and costs nothing until enabled.
+
+            == Args ==
+            - log_stats (bool) - (Default: False) log the stats after each conversion
+
+            == Example ==
+            Enable T128 Conversion Profiling
+            Enable T128 Conversion Profiling    log_stats=${True}
+        """
+        self.profiler = netconfconverter.ConversionProfiler(log_stats)
+        self.ncconv.profiler = self.profiler
+
+    def disable_t128_conversion_profiling(self):
+        """
+            Stops collecting conversion timers and counters.
+
+            == Example ==
+            Disable T128 Conversion Profiling
+        """
+        self.profiler = None
+        self.ncconv.profiler = None
+
+    def get_t128_conversion_stats(self):
+        """
+            Returns the timers, counters and cache hit rates collected since
+            profiling was enabled or last reset, or None when profiling is off.
+
+            == Example ==
+            ${stats}=    Get T128 Conversion Stats
+        """
+        if self.profiler is None:
+            return None
+        return self.profiler.stats()
+
+    def reset_t128_conversion_stats(self):
+        """
+            Clears the collected conversion timers and counters.
+
+            == Example ==
+            Reset T128 Conversion Stats
+        """
+        if self.profiler is not None:
+            self.profiler.reset()
 
     def load_t128_user_config_model(self, model_file):
         """
@@ -39,19 +168,107 @@ class Config(object):
         logger.debug('model_file: {}'.format(model_file))
         return self.ncconv.load_user_model(model_file)
 
-    def convert_config_to_netconf_xml(self, config_list, tag='config', attributes={}):
+    def convert_config_to_netconf_xml(self, config_list, tag='config', attributes={}, output=None, pretty=True,
+                                      collect_errors=False):
         """
             Converts a T128 configuration to [Netconf.html | Netconf] XML. The
             ``config_list`` should be specified as a list i.e. using a ``@{ _NAME_
-            }`` type variable.  The first line must be ``config`` with a matching
+            }`` type variable, or as an open file or other iterable of lines, which
+            is read lazily.  The first line must be ``config`` with a matching
             ``exit`` at the end.
 
             == Args ==
-            - config_list (list) - list of config elements
+            - config_list (list) - list, file or iterable of config elements
             - tag (str) - (Default: config) a tag to tell that the file it is given is a config file
             - attributes (dict) - a dictionary containing additional tag attributes
+            - output (file) - (Default: None) binary file object to stream the xml to instead of returning it
+            - pretty (bool) - (Default: True) add indentation text between elements; when False the tree
+              has no whitespace text nodes and can be pretty printed when serialized instead
+            - collect_errors (bool) - (Default: False) report every failing line in one ``ConfigParseError``
+              instead of stopping at the first; each error gives the line number, column, token and path.
+              The block opened by a failing line is found by its indentation, so this requires indented
+              config lines; a ``@{list}`` without indentation stops at the first failing line that is not
+              a known leaf
 
             == Example ==
             Convert Config to Netconf xml    ${config_list}    ${tag}    ${attributes}
+            Convert Config to Netconf xml    ${config_list}    pretty=${False}
+            Convert Config to Netconf xml    ${config_list}    collect_errors=${True}
+        """
+        return self.ncconv.convert_config_to_netconf_xml(config_list, tag, attributes, output, pretty, collect_errors)
+
+    def convert_config_to_netconf_xml_parallel(self, config_list, tag='config', attributes={}, processes=None):
+        """
+            Converts a T128 configuration to [Netconf.html | Netconf] XML like
+            `Convert Config To Netconf Xml`, converting each top-level object
+            under ``authority`` in a pool of worker processes.
+
+            == Args ==
+            - config_list (list) - list, file or iterable of config elements
+            - tag (str) - (Default: config) a tag to tell that the file it is given is a config file
+            - attributes (dict) - a dictionary containing additional tag attributes
+            - processes (int) - (Default: cpu count) number of worker processes
+
+            == Example ==
+            Convert Config to Netconf xml Parallel    ${config_list}    processes=8
+        """
+        return self.ncconv.convert_config_to_netconf_xml_parallel(config_list, tag, attributes, processes)
+
+    def convert_netconf_xml_to_config(self, source, output=None):
+        """
+            Converts [Netconf.html | Netconf] XML, such as a running config
+            retrieved with get_config, back to flat-text T128 configuration.
+            The xml is read incrementally and the result uses the same
+            indentation and ``exit`` structure that `Convert Config To Netconf
+            Xml` accepts.
+
+            == Args ==
+            - source (str) - xml file name, binary file object or parsed xml element
+            - output (file) - (Default: None) text file object to write the config to instead of returning it
+
+            == Example ==
+            ${config_text}=    Convert Netconf Xml To Config    ${running_xml}
+        """
+        return self.ncconv.convert_netconf_xml_to_config(source, output)
+
+    def diff_netconf_xml(self, current_xml, desired_xml, tag='config', attributes={}, partial=False):
+        """
+            Builds the minimal [Netconf.html | Netconf] edit-config payload that
+            changes ``current_xml`` into ``desired_xml``, matching list entries
+            by their keys. Returns None when there is nothing to change.
+
+            == Args ==
+            - current_xml (element) - current config, for example the running config data
+            - desired_xml (element) - desired config, for example from `Convert Config To Netconf Xml`
+            - tag (str) - (Default: config) tag of the payload root
+            - attributes (dict) - a dictionary containing additional tag attributes
+            - partial (bool) - (Default: False) ``desired_xml`` holds only part of the config: only delete
+              what is missing inside its list entries, such as routers and services, and keep everything
+              else that is missing from it
+
+            == Example ==
+            ${payload}=    Diff Netconf Xml    ${running_xml}    ${desired_xml}
+        """
+        return self.ncconv.diff_netconf_xml(current_xml, desired_xml, tag, attributes, partial)
+
+    def convert_batch(self, configs, tag='config', attributes={}):
+        """
+            Converts several T128 configurations to [Netconf.html | Netconf] XML
+            with the already loaded model. Returns a list with one ``(xml,
+            error)`` pair per config, in order; a config that fails to convert
+            has ``None`` as its xml and the ``ConfigParseError`` as its error
+            without stopping the rest of the batch.
+
+            == Args ==
+            - configs (list) - list of configs, each accepted by `Convert Config To Netconf Xml`
+            - tag (str) - (Default: config) a tag to tell that the file it is given is a config file
+            - attributes (dict) - a dictionary containing additional tag attributes
+
+            == Example ==
+            ${results}=    Convert Batch    ${configs}
         """
-        return self.ncconv.convert_config_to_netconf_xml(config_list, tag, attributes)
+        results = list(self.ncconv.convert_many(configs, tag, attributes))
+        for index, (_, error) in enumerate(results):
+            if error is not None:
+                logger.warning('config {} failed to convert: {}'.format(index, error))
+        return results